@@ -0,0 +1,118 @@
+#!/bin/python3
+
+"""
+Find good launch parameters for the OpenCL device on this machine by trying them out: n_instances, local_size, and BLOCK_SIZE.
+The optimal values vary a lot from one device to another. Every configuration is checked against a reference computed
+by NumpyDevice, so that a configuration that is fast but gives wrong results (e.g., because it runs out of some resource)
+is never chosen. The winner is saved on disk, and from then on OpenClDevice uses it by default, so that Oscillator.run()
+picks it up automatically.
+The saved configuration is per device, not per workload: it's used for every render on this device, whatever its number
+of partials and knots, so the shape given here should be typical of the renders you care about. Running this again with a
+different shape replaces the saved configuration rather than adding to it.
+Usage:
+  autotune.py [n_partials n_knots length_sec]
+"""
+
+import sys,time,math
+import numpy
+import pyopencl as cl
+
+from opencl_device import OpenClDevice,save_tuning
+from numpy_device import NumpyDevice
+from oscillator import Oscillator
+from partial import HarmonicStack
+from pie import Pie
+
+def main():
+  shape = {'n_partials':32,'n_knots':40,'length_sec':1.0}
+  if len(sys.argv)>1:
+    shape = {'n_partials':int(sys.argv[1]),'n_knots':int(sys.argv[2]),'length_sec':float(sys.argv[3])}
+  autotune('oscillator.cl',shape)
+
+def autotune(source_filename,shape,block_sizes=[16,32,64,128,256],local_sizes=[16,32,64,128,256],
+             n_instances_list=[64,128,256,512,1024,2048,4096],repeats=3,tolerance=0.01,sample_freq=44100.0):
+  """
+  Try every combination of the given values on a workload with the given shape, which is a dict with keys n_partials,
+  n_knots (number of knots per partial), and length_sec. Saves the fastest configuration that gives correct results,
+  and also returns it. tolerance is the maximum error allowed, relative to the peak amplitude of the reference. A
+  configuration that the device can't handle, so that building or running raises an OpenCL error, is skipped.
+  """
+  partials = workload(shape)
+  n_samples = int(shape['length_sec']*sample_freq)
+  pars = {'n_samples':n_samples,'t0':0.0,'dt':1/sample_freq}
+  ref_dev = NumpyDevice()
+  ref = Oscillator(pars,partials,ref_dev)
+  ref.run(ref_dev)
+  y_ref = ref.y()
+  peak = numpy.max(numpy.abs(y_ref))
+  best = None
+  for block_size in block_sizes:
+    try:
+      dev = OpenClDevice(limits={'BLOCK_SIZE':block_size},use_tuning=False)
+      dev.build(source_filename)
+    except cl.Error as e:
+      print(f"BLOCK_SIZE={block_size}: OpenCL error building the kernel, skipped: {e}")
+      continue
+    max_local = dev.device.max_work_group_size
+    for local_size in local_sizes:
+      if local_size>max_local:
+        continue
+      for n_instances in n_instances_list:
+        if n_instances%local_size!=0 or n_instances>dev.limits['MAX_INSTANCES']:
+          continue
+        config = {'BLOCK_SIZE':block_size,'local_size':local_size,'n_instances':n_instances}
+        try:
+          t = time_config(dev,pars,partials,config,y_ref,peak,repeats,tolerance)
+        except cl.Error as e:
+          # e.g., out of resources for this combination of local_size and BLOCK_SIZE; the rest may still work
+          print(f"{config}: OpenCL error, skipped: {e}")
+          continue
+        if t is not None and (best is None or t<best['time']):
+          best = dict(config)
+          best['time'] = t
+  if best is None:
+    raise Exception("no configuration gave correct results")
+  best['shape'] = shape
+  save_tuning(dev.identity(),best)
+  print(f"best configuration: {best}")
+  return best
+
+def time_config(dev,pars,partials,config,y_ref,peak,repeats,tolerance):
+  """
+  Run the workload with one configuration, and return the best time out of repeats runs, or None if the results were wrong.
+  """
+  local_size = config['local_size']
+  p = dict(pars)
+  p['n_instances'] = config['n_instances']
+  osc = Oscillator(p,partials,dev)
+  osc.run(dev,local_size) # warm-up, and also the run we check for correctness
+  if osc.error_code()!=0:
+    print(f"{config}: error code {osc.error_code()}, rejected")
+    return None
+  err = numpy.max(numpy.abs(numpy.asarray(osc.y(),dtype=numpy.float64)-y_ref))/peak
+  if not (err<=tolerance):
+    print(f"{config}: relative error {err}, rejected")
+    return None
+  t = math.inf
+  for i in range(repeats):
+    timer_start = time.perf_counter()
+    osc.run(dev,local_size)
+    t = min(t,time.perf_counter()-timer_start)
+  print(f"{config}: {t*1000} ms")
+  return t
+
+def workload(shape):
+  """
+  A harmonic tone with vibrato, with the given number of partials and knots per partial. Like the tones made in honk.py,
+  it's a HarmonicStack, so that what gets timed is the kernel's path for harmonic series, with a single phase spline.
+  """
+  length = shape['length_sec']
+  fc = 290.0
+  t = numpy.linspace(0.0,length,shape['n_knots'])
+  f = fc*(1.0+0.006*(-1.0)**numpy.arange(len(t))) # alternating extrema of the frequency, as with vibrato
+  f = Pie.join_extrema(t,f)
+  a = Pie.join_extrema([0.0,0.5*length,length],[0.5,1.0,0.5])
+  return HarmonicStack(f,list(map(lambda n:a.scalar_mult(1.0/n),range(1,shape['n_partials']+1))))
+
+if __name__=='__main__':
+  main()
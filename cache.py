@@ -0,0 +1,21 @@
+"""
+A place to keep files that are expensive to generate but can be regenerated at any time, such as compiled kernels.
+The location is $HONK_CACHE_DIR if that's set, otherwise ~/.cache/honk.
+"""
+
+import os
+
+def cache_dir(subdir):
+  base = os.environ.get('HONK_CACHE_DIR')
+  if not base:
+    base = os.path.join(os.path.expanduser('~'),'.cache','honk')
+  d = os.path.join(base,subdir)
+  os.makedirs(d,exist_ok=True)
+  return d
+
+def write_atomically(filename,data):
+  # Write to a temporary file and then rename it, so that another process reading the cache never sees a partially written file.
+  tmp = f"{filename}.{os.getpid()}.tmp"
+  with open(tmp,'wb') as f:
+    f.write(data)
+  os.replace(tmp,filename)
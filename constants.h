@@ -8,16 +8,54 @@
 
 // ... if changing these, also change oscillator,py, error_to_string()
 
-// When changing one of the following, need to do a "make cpu_c.so".
+// The following limits are only defaults. OpenClDevice passes the values it's actually using as -D options when it compiles
+// the kernel, and the python code reads them from the device object (see constants.py).
 
+#ifndef MAX_INSTANCES
 #define MAX_INSTANCES 65536
-/* ... used to set size of error return array; this is in global memory, which is plentiful, so not much harm in making it much bigger than the
-       number of instances ewe actually expect to have
-*/
+#endif
+// ... maximum number of instances in one launch; the error return arrays are sized to the actual number of instances
+
+#define ERROR_DETAILS_SIZE 4
+// ... number of ints per instance in error_details
+
+#ifndef MAX_SPLINE_KNOTS
 #define MAX_SPLINE_KNOTS 300
+#endif
 // ... total in all partials
 #define A_SPLINE_ORDER 3
 #define PHASE_SPLINE_ORDER 4
 #define MAX_SPLINE_COEFFS (MAX_SPLINE_KNOTS*(PHASE_SPLINE_ORDER+1))
 // ... total number of cubic spline coefficients in all partials
+#ifndef MAX_PARTIALS
 #define MAX_PARTIALS 64
+#endif
+#define ACTIVE_MASK_WORDS ((MAX_PARTIALS+31)/32)
+// ... number of 32-bit words per instance in the bit mask that says which partials are active; see IS_ACTIVE in oscillator.cl
+
+// For efficiency, break the calculation into small blocks, so that each block can fit in private memory.
+#ifndef BLOCK_SIZE
+#define BLOCK_SIZE 64
+#endif
+// ... Has to be small enough so that we can have a private array of floats of this size. Seems to run OK with values as big as 512.
+//     Bigger sizes are slightly more efficient. For a sound with 8 partials, a block size of 4 was significantly better than 1,
+//     but bigger sizes were no better. For sounds with a lot of partials, big block sizes are likely to help.
+
+// Number of ints per partial and per note in the tables used by oscillator_batch; see OscillatorBatch in oscillator.py.
+#define PARTIAL_I_SIZE 6
+#define NOTE_I_SIZE 4
+// Number of ints per partial per workgroup in the table of windows used by oscillator_windowed; see OscillatorWindowed.
+#define WINDOW_I_SIZE 4
+
+// Maximum number of work items in a workgroup of oscillator_2d, i.e., local_size times the number of lanes; this is the size of
+// the local array used for adding up the lanes. See fn_osc_2d() in oscillator.cl.
+#define MAX_LOCAL_2D 1024
+
+// Modes for the oscillator kernel, passed in i_pars[5]; see fn_osc().
+#define OSC_MODE_GENERAL 0
+#define OSC_MODE_HARMONIC 1
+#define OSC_MODE_RECURRENCE 2
+
+// In OSC_MODE_RECURRENCE, the number of harmonics after which we recompute sin(n*phi) directly rather than continuing to use
+// the recurrence, in which rounding errors accumulate.
+#define RECURRENCE_ANCHOR 16
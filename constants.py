@@ -0,0 +1,44 @@
+"""
+Gives the python code access to the values #defined in constants.h, so that they only need to be set in one place.
+Some of these are limits on the sizes of the data handled by one kernel launch. For those, the values in constants.h
+are only defaults, which can be overridden at runtime. A device object carries the limits it's actually using, and
+OpenClDevice passes them to the compiler as -D options.
+"""
+
+import os,re
+
+LIMIT_NAMES = ['MAX_SPLINE_KNOTS','MAX_PARTIALS','MAX_INSTANCES','BLOCK_SIZE']
+
+def read(filename=None):
+  """
+  Returns a dict containing every #define in the file that has an integer value.
+  """
+  if filename is None:
+    filename = os.path.join(os.path.dirname(os.path.abspath(__file__)),'constants.h')
+  result = {}
+  with open(filename,'r') as f:
+    for line in f:
+      capture = re.match(r"\s*#define\s+(\w+)\s+(-?\d+)\s*(//.*)?$",line)
+      if capture:
+        result[capture.group(1)] = int(capture.group(2))
+  return result
+
+defaults = read()
+
+def limits(overrides=None):
+  """
+  Returns a dict containing the limits, with the defaults from constants.h replaced by any values given in the dict overrides.
+  Also contains SPLINE_ORDER, MAX_SPLINE_COEFFS, and ACTIVE_MASK_WORDS, which are derived from the others.
+  """
+  result = {}
+  for name in LIMIT_NAMES:
+    result[name] = defaults[name]
+  if overrides is not None:
+    for name in overrides:
+      if not (name in LIMIT_NAMES):
+        raise Exception(f"{name} is not one of the limits that can be set at runtime, which are {LIMIT_NAMES}")
+      result[name] = int(overrides[name])
+  result['SPLINE_ORDER'] = defaults['PHASE_SPLINE_ORDER'] # is greater than A_SPLINE_ORDER
+  result['MAX_SPLINE_COEFFS'] = result['MAX_SPLINE_KNOTS']*(defaults['PHASE_SPLINE_ORDER']+1)
+  result['ACTIVE_MASK_WORDS'] = (result['MAX_PARTIALS']+31)//32
+  return result
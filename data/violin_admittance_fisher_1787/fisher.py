@@ -10,7 +10,7 @@ import data.violin_admittance_fisher_1787.fisher as fisher
 
 def admittance(f):
   """
-  Input is frequency in Hz. Output is bridge admittance as a gain factor (linear, not db).
+  Input is frequency in Hz, which can be a numpy array. Output is bridge admittance as a gain factor (linear, not db).
   """
   if not hasattr(admittance,"func"):
     x = []
@@ -9,12 +9,13 @@ Bissinger has data in absolute SI units, but I only attempted to extract relativ
 """
 
 import math
+import numpy
 import scipy.interpolate
 import data.violin_bissinger_radiation_gain.bissinger as bissinger
 
 def radiation_gain(f):
   """
-  Input is frequency in Hz. Output is a gain factor (linear, not db).
+  Input is frequency in Hz, which can be a numpy array. Output is a gain factor (linear, not db).
   """
   if not hasattr(radiation_gain,"func"):
     x = []
@@ -34,12 +35,11 @@ def radiation_gain(f):
   gain = 10.0**a
   max_f = 980.0 # maximum freq for which I have data
   cutoff = 4500.0
-  if f<max_f:
-    return gain
-  if f>max_f and f<cutoff:
-    return gain*math.sqrt(f/max_f) # not sure if this is right
-  # fall through, f>=cutoff
-  return gain*math.sqrt(cutoff/max_f) # not sure if this is right
+  f = numpy.asarray(f,dtype=numpy.float64)
+  return numpy.where(f<max_f,gain,
+         numpy.where(numpy.logical_and(f>max_f,f<cutoff),
+                     gain*numpy.sqrt(f/max_f), # not sure if this is right
+                     gain*math.sqrt(cutoff/max_f))) # f>=cutoff (or f==max_f); not sure if this is right
 
 def ry_list():
   """
@@ -7,7 +7,10 @@
 #define __constant
 #define __local
 #define __private
+#define barrier(x) // there's only one work item per group
+#define CLK_LOCAL_MEM_FENCE 0
 #define FLOAT double
+typedef unsigned int uint;
 #else
 #define FLOAT float
 #endif
@@ -1,17 +1,58 @@
 FLOAT spline(__local FLOAT *c,__local FLOAT *knots,int n,int k,int *i,FLOAT x,int *err);
-void fn_osc(__global FLOAT *y,int i,
+void fn_osc(__global FLOAT *y,int i,int lid,int lsize,
                          __global int *err, __global int *error_details,__global FLOAT *info,__global int *n_info,
                          __global const FLOAT *v1, __global const FLOAT *v2, __global const FLOAT *v3, __global const FLOAT *v4,
-                         __global const int *k1,  __global const int *k2,
-                         __global const long *i_pars, __global const FLOAT *f_pars);
-void oscillator_cubic_spline(__global FLOAT *y,__global int *err,__global int *error_details,int i,
+                         __global const int *k1,  __global const int *k2, __global const FLOAT *mult,
+                         __global const uint *active, __global const int *cursors,
+                         __global const long *i_pars, __global const FLOAT *f_pars,
+                         __local int *phi_n, __local int *a_n, __local FLOAT *phi_knots, __local FLOAT *a_knots,
+                         __local FLOAT *phi_c_local, __local FLOAT *a_c_local, __local FLOAT *mult_local);
+void oscillator_cubic_spline(__global FLOAT *y,int accumulate,__global int *err,__global int *error_details,int i,
                              __local FLOAT *omega_c,__local FLOAT *omega_knots,__local int *omega_n,
                              __local FLOAT *a_c,    __local FLOAT *a_knots,    __local int *a_n,
+                             int mode,__local FLOAT *mult,__global const uint *active,
+                             __global const int *cursors,int incremental,
                              FLOAT t0,FLOAT dt,int j1,int j2,int n_partials);
-void oscillator_cubic_spline_one_block(FLOAT *y,__global int *err,__global int *error_details,int instance,
+int oscillator_cubic_spline_one_block(FLOAT *y,
                              __local FLOAT *phi_c,__local FLOAT *phi_knots,__local int *phi_n,
                              __local FLOAT *a_c,    __local FLOAT *a_knots,    __local int *a_n,
-                             FLOAT t0,FLOAT dt,int j1,int j2,int n_partials);
+                             __global const uint *active,int *phi_i,int *a_i,
+                             int incremental,FLOAT t0,FLOAT dt,int n,int n_partials);
+int oscillator_harmonic_one_block(FLOAT *y,
+                             __local FLOAT *phi_c,__local FLOAT *phi_knots,__local int *phi_n,
+                             __local FLOAT *a_c,    __local FLOAT *a_knots,    __local int *a_n,
+                             __local FLOAT *mult,__global const uint *active,int *phi_i,int *a_i,
+                             int incremental,FLOAT t0,FLOAT dt,int n,int n_partials);
+int oscillator_recurrence_one_block(FLOAT *y,
+                             __local FLOAT *phi_c,__local FLOAT *phi_knots,__local int *phi_n,
+                             __local FLOAT *a_c,    __local FLOAT *a_knots,    __local int *a_n,
+                             __local FLOAT *mult,__global const uint *active,int *phi_i,int *a_i,
+                             int incremental,FLOAT t0,FLOAT dt,int n_samples,int n_partials);
+int spline_block(__local FLOAT *c,__local FLOAT *knots,int n,int k,int *i,FLOAT x0,FLOAT h,int n_out,int incremental,
+                 FLOAT *out);
+void forward_differences(__local FLOAT *c,int n,int k,int i,FLOAT d,FLOAT h,FLOAT *diff);
+void fn_osc_batch(__global FLOAT *y,int i,
+                         __global int *err, __global int *error_details,
+                         __global const FLOAT *v1, __global const FLOAT *v2, __global const FLOAT *v3, __global const FLOAT *v4,
+                         __global const int *partial_i, __global const int *note_i, __global const FLOAT *note_f,
+                         __global const int *inst_notes_start, __global const int *inst_notes,
+                         __global const long *i_pars, __global const FLOAT *f_pars);
+void fn_osc_windowed(__global FLOAT *y,int i,int group,int lid,int lsize,
+                         __global int *err, __global int *error_details,
+                         __global const FLOAT *v1, __global const FLOAT *v2, __global const FLOAT *v3, __global const FLOAT *v4,
+                         __global const int *partial_i, __global const int *window_i,
+                         __global const long *i_pars, __global const FLOAT *f_pars,
+                         __local int *phi_n, __local int *a_n, __local FLOAT *phi_knots, __local FLOAT *a_knots,
+                         __local FLOAT *phi_c, __local FLOAT *a_c);
+void fn_osc_2d(__global FLOAT *y,int i,int group,int lid,int lsize,int lane,int n_lanes,
+                         __global int *err, __global int *error_details,
+                         __global const FLOAT *v1, __global const FLOAT *v2, __global const FLOAT *v3, __global const FLOAT *v4,
+                         __global const int *k1,  __global const int *k2, __global const FLOAT *mult,
+                         __global const uint *active,
+                         __global const long *i_pars, __global const FLOAT *f_pars,
+                         __local int *offsets, __local FLOAT *sums);
+FLOAT spline_global(__global const FLOAT *c,__global const FLOAT *knots,int n,int k,int *i,FLOAT x,int *local_err);
+int find_knot_global(__global const FLOAT *knots,int n,FLOAT x);
 void fn_zeta(__global FLOAT *y,int i);
 FLOAT zeta(FLOAT s);
 void flag_err(__global int *error_array,int instance,int err,int where_in_code);
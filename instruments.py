@@ -1,6 +1,5 @@
 import math,numpy,scipy
-import data.violin_admittance_fisher_1787.fisher as fisher
-import data.violin_bissinger_radiation_gain.bissinger as bissinger
+from response_table import ResponseTable
 
 def violin_envelope(n_partials=100,instrument="violin",f=None,brightness=0,what="bd",norm=1):
   """
@@ -46,6 +45,14 @@ def normalize(amplitudes,norm):
   return k*numpy.array(amplitudes)
 
 def fisher_response(f):
+  # f can be a number or a numpy array of frequencies, as with all the response functions; see Partial.filter().
+  # This is looked up in a precomputed table; see response_table.py.
+  return fisher_table(f)
+
+def fisher_response_exact(f):
+  # The data are imported here so that we don't have to load them except when compiling the table.
+  import data.violin_admittance_fisher_1787.fisher as fisher
+  import data.violin_bissinger_radiation_gain.bissinger as bissinger
   return fisher.admittance(f)*bissinger.radiation_gain(f)*(f/1000.0)**-0.76
   # Explanation of the third factor:
   #   This factor is because empirically, without it, the tone comes out much too bright by ear.
@@ -56,21 +63,24 @@ def fisher_response(f):
   #   an exponent of ((ln10)/(10ln2))(-2.3)=-0.76. After inserting this factor, checked that the spectrum's envelope seemed to match
   #   the real violin note, and it did seem to.
 
+fisher_table = ResponseTable('violin_fisher',fisher_response_exact,
+                  ['instruments','data.violin_admittance_fisher_1787.fisher','data.violin_bissinger_radiation_gain.bissinger'])
+
 def log_comb_response(f,contrast=10,spacing=1.06,i=3,ic=0.7,offset=0):
   """
   Simulate a response function of the type described by Mathews and Kohut, 1973, Electronic simulation of violin resonances.
   Spacing of filter is in units of whole-tones. Mathews lists frequencies with spacings that vary somewhat irregularly.
   Contrast is dB power. A contrast of 15 produces a clear difference from the unfiltered tone, but an uneven tone.
-  Output is a gain (in linear amplitude units).
+  Output is a gain (in linear amplitude units). f can be a numpy array.
   """
   mathews = [.24,.07,-.17,-.11,.02,-.07,-.03,.01,.04,.06,.01,0.0,.03,-.02,-.13,.06,.05,-.04,.07,.06,.02,.03,-.07]
   # difference, in whole tones, between best-fit linear rule and mathews's slightly irregular frequencies
 
-  x = 54.388*math.log(f)/spacing+offset*0.628318530717959
+  x = 54.388*numpy.log(f)/spacing+offset*0.628318530717959
   # ... Pitch in wholetones, times 2pi. The first numerical factor is (6/ln2)(2pi). The second one is 2pi/10, so that
   #     an offset of 10 moves us by one whole step, or approximately one comb spacing.
 
-  irreg = i*0.1*math.sin(ic*x)
+  irreg = i*0.1*numpy.sin(ic*x)
   '''
        Add some irregularity to the spacing. The 0.1 is just so I can use integer-ish values of i.
        The value of ic is somewhat arbitrary, just meant to represent the "wavelength" of the variation in Mathews' numbers.
@@ -81,11 +91,11 @@ def log_comb_response(f,contrast=10,spacing=1.06,i=3,ic=0.7,offset=0):
        for which I was able to hear any audible effect.
   '''   
 
-  y = 0.057565*contrast*math.sin(x+irreg)
+  y = 0.057565*contrast*numpy.sin(x+irreg)
   # ... the numerical factor is (1/2)(1/2)(1/10)ln 10; reasons for factors are as follows:
   #     1/2 ... sine function has a peak-to-peak variation of 2 units
   #     1/2 ... put it in linear amplitude units (as opposed to contrast, which is in db power units)
   #     1/10 ... because it's *deci*bels
   #     ln 10 ... bels are base 10
 
-  return math.exp(y)
+  return numpy.exp(y)
@@ -0,0 +1,160 @@
+"""
+A stand-in for OpenClDevice that does the synthesis on the CPU using numpy, for machines that don't have a usable
+OpenCL driver. It consumes the same flattened arrays that OscillatorLowLevel.setup() prepares for the kernel in oscillator.cl.
+Rather than looping over samples one at a time, it evaluates each spline on a whole block of samples at once.
+"""
+
+import numpy
+import constants
+
+A_SPLINE_ORDER = constants.defaults['A_SPLINE_ORDER']
+PHASE_SPLINE_ORDER = constants.defaults['PHASE_SPLINE_ORDER']
+HONK_ERR_ILLEGAL_VALUE = constants.defaults['HONK_ERR_ILLEGAL_VALUE']
+PARTIAL_I_SIZE = constants.defaults['PARTIAL_I_SIZE']
+NOTE_I_SIZE = constants.defaults['NOTE_I_SIZE']
+OSC_MODE_HARMONIC = constants.defaults['OSC_MODE_HARMONIC']
+OSC_MODE_RECURRENCE = constants.defaults['OSC_MODE_RECURRENCE']
+
+class NumpyDevice:
+  backend = 'numpy'
+  def __init__(self,block_size=65536,limits=None):
+    # block_size = number of samples that are evaluated at once; bigger is a little faster but uses more memory
+    # limits = optional overrides for the limits in constants.h; we don't need them, but the code that splits up the data does
+    self.block_size = block_size
+    self.limits = constants.limits(limits)
+
+  def build(self,source_filename=None):
+    # There is nothing to compile. This exists so that NumpyDevice can be used interchangeably with OpenClDevice.
+    return self
+
+  def launch_config(self):
+    # n_instances doesn't matter to us, but it does determine the size of the error reporting arrays.
+    return {'n_instances':256,'local_size':64}
+
+  def finish(self):
+    # Everything we do is synchronous, so there's never anything to wait for.
+    pass
+
+  def oscillator(self,y,err,phi_c,phi_knots,a_c,a_knots,phi_n,a_n,mult,active,i_pars,f_pars):
+    """
+    Does the same computation as the oscillator kernel in oscillator.cl, with the same inputs, except that active can be None,
+    meaning that all partials are active. Errors are reported as if they came from instance 0. The error code has the same
+    format as in the kernel, but there is no line number.
+    """
+    samples_per_instance = int(i_pars[0])
+    n_partials = int(i_pars[1])
+    n_samples = int(i_pars[2])
+    offset = int(i_pars[3]) # index in y of our first sample
+    accumulate = (i_pars[4]!=0) # add to what's in y rather than overwriting it
+    # In the harmonic modes, there is one phase spline, shared by all the partials, with multipliers in mult. We don't need the
+    # recurrence that the kernel uses in OSC_MODE_RECURRENCE, since numpy.sin() is fast when done on a whole block at once.
+    harmonic = (i_pars[5]==OSC_MODE_HARMONIC or i_pars[5]==OSC_MODE_RECURRENCE)
+    t0 = float(f_pars[0])
+    dt = float(f_pars[1])
+    if active is not None:
+      # one row per instance, one column per partial, as in IS_ACTIVE in oscillator.cl
+      words = self.limits['ACTIVE_MASK_WORDS']
+      active = numpy.unpackbits(active.view(numpy.uint8).reshape(-1,4*words),axis=1,bitorder='little').astype(bool)
+    for j1 in range(0,n_samples,self.block_size):
+      j2 = min(j1+self.block_size,n_samples) # exclusive
+      t = t0+dt*numpy.arange(j1,j2,dtype=numpy.float64)
+      block = numpy.zeros(j2-j1,numpy.float64)
+      instance = numpy.arange(j1,j2)//samples_per_instance
+      if harmonic:
+        phi_size = (int(phi_n[0])-1)*(PHASE_SPLINE_ORDER+1)
+        phi,phi_ok = spline(phi_c[0:phi_size],phi_knots[0:int(phi_n[0])],PHASE_SPLINE_ORDER,t)
+        if not phi_ok:
+          flag_err(err,HONK_ERR_ILLEGAL_VALUE)
+          return
+      k_phi = 0 # index into phi_knots
+      k_a = 0
+      kc_phi = 0 # index into phi_c
+      kc_a = 0
+      for m in range(n_partials):
+        this_phi_n = int(phi_n[m])
+        this_a_n = int(a_n[m])
+        phi_size = (this_phi_n-1)*(PHASE_SPLINE_ORDER+1) # n-1 because there are no coeffs associated with rightmost knot
+        a_size = (this_a_n-1)*(A_SPLINE_ORDER+1)
+        if active is None:
+          on = slice(None) # all the samples
+        else:
+          on = active[instance,m]
+        if active is None or numpy.any(on):
+          if not harmonic:
+            phi,phi_ok = spline(phi_c[kc_phi:kc_phi+phi_size],phi_knots[k_phi:k_phi+this_phi_n],PHASE_SPLINE_ORDER,t[on])
+          a,a_ok = spline(a_c[kc_a:kc_a+a_size],a_knots[k_a:k_a+this_a_n],A_SPLINE_ORDER,t[on])
+          if not (phi_ok and a_ok):
+            flag_err(err,HONK_ERR_ILLEGAL_VALUE)
+            return
+          if harmonic:
+            block[on] += a*numpy.sin(float(mult[m])*phi[on])
+          else:
+            block[on] += a*numpy.sin(phi)
+        if not harmonic:
+          k_phi += this_phi_n
+          kc_phi += phi_size
+        k_a += this_a_n
+        kc_a += a_size
+      if accumulate:
+        y[offset+j1:offset+j2] += block
+      else:
+        y[offset+j1:offset+j2] = block
+
+  def oscillator_windowed(self,y,err,phi_c,phi_knots,a_c,a_knots,partial_i,i_pars,f_pars):
+    """
+    Does the same computation as the oscillator_windowed kernel in oscillator.cl. We don't need the windows, since we aren't
+    limited by the size of local memory, and the flattened data are laid out the same way as for oscillator().
+    """
+    partial_i = partial_i.reshape(-1,PARTIAL_I_SIZE)
+    self.oscillator(y,err,phi_c,phi_knots,a_c,a_knots,partial_i[:,0],partial_i[:,1],numpy.ones(len(partial_i)),None,
+                    i_pars,f_pars)
+
+  def oscillator_batch(self,y,err,phi_c,phi_knots,a_c,a_knots,partial_i,note_i,note_f,i_pars,f_pars):
+    """
+    Does the same computation as the oscillator_batch kernel in oscillator.cl. The inputs are the same, except that we don't
+    need the tables that tell each instance which notes it overlaps.
+    """
+    n_samples = int(i_pars[2])
+    dt = float(f_pars[0])
+    partial_i = partial_i.reshape(-1,PARTIAL_I_SIZE)
+    note_i = note_i.reshape(-1,NOTE_I_SIZE)
+    y[0:n_samples] = 0.0
+    for k in range(len(note_i)):
+      first_partial,n_partials,offset,note_n = map(int,note_i[k])
+      lo = max(offset,0)
+      hi = min(offset+note_n,n_samples) # exclusive
+      for j1 in range(lo,hi,self.block_size):
+        j2 = min(j1+self.block_size,hi)
+        t = float(note_f[k])+dt*numpy.arange(j1-offset,j2-offset,dtype=numpy.float64)
+        for p in range(first_partial,first_partial+n_partials):
+          phi_n,a_n,k_phi_c,k_phi,k_a_c,k_a = map(int,partial_i[p])
+          phi,phi_ok = spline(phi_c[k_phi_c:k_phi_c+(phi_n-1)*(PHASE_SPLINE_ORDER+1)],phi_knots[k_phi:k_phi+phi_n],PHASE_SPLINE_ORDER,t)
+          a,a_ok = spline(a_c[k_a_c:k_a_c+(a_n-1)*(A_SPLINE_ORDER+1)],a_knots[k_a:k_a+a_n],A_SPLINE_ORDER,t)
+          if not (phi_ok and a_ok):
+            flag_err(err,HONK_ERR_ILLEGAL_VALUE)
+            return
+          y[j1:j2] += a*numpy.sin(phi)
+
+def flag_err(err,code):
+  # Same format as flag_err() in oscillator.cl, for instance 0.
+  err[0] = 1
+  err[1] = code*1000
+
+def spline(c,knots,k,t):
+  """
+  Vectorized version of spline() in oscillator.cl. The input c is flattened in the same way as for that function.
+  Evaluates the spline at all the points in the array t, which must be sorted. Returns the values and a flag saying whether
+  the result is legal, which it isn't if some t lies to the left of the first knot.
+  """
+  n = len(knots)
+  c = numpy.asarray(c,dtype=numpy.float64).reshape(k+1,n-1)
+  knots = numpy.asarray(knots,dtype=numpy.float64)
+  # Same choice of interval as the linear search in spline(): the first i such that t<=knots[i+1], but never beyond n-2.
+  i = numpy.searchsorted(knots[1:n-1],t,side='left')
+  d = t-knots[i]
+  if len(d)>0 and d[0]<0:
+    return (None,False)
+  s = c[0][i]
+  for m in range(1,k+1):
+    s = s*d+c[m][i] # Horner's rule
+  return (s,True)
@@ -1,17 +1,159 @@
+import os,re,hashlib,json
+import numpy
 import pyopencl as cl
+import constants,cache
 
 class OpenClDevice:
-  def __init__(self):
+  backend = 'opencl'
+  def __init__(self,limits=None,use_tuning=True):
+    """
+    limits is an optional dict overriding some of the limits in constants.h, e.g., {'MAX_PARTIALS':32}; see constants.limits()
+    If use_tuning is true and autotune.py has saved a configuration for this device, then we use its BLOCK_SIZE (unless limits
+    says otherwise), and launch_config() gives its n_instances and local_size. The tuning is per device, not per workload:
+    whatever workload it was found with (recorded under 'shape' in the file) is assumed to be representative, and the same
+    values are used for every render on this device.
+    """
     self.platform = cl.get_platforms()[0]
     self.device = self.platform.get_devices()[0]
     self.context = cl.Context([self.device])
+    self.tuning = None
+    if use_tuning:
+      self.tuning = load_tuning(self.identity())
+    overrides = {}
+    if self.tuning is not None:
+      overrides['BLOCK_SIZE'] = self.tuning['BLOCK_SIZE']
+    if limits is not None:
+      overrides.update(limits)
+    self.limits = constants.limits(overrides)
+    self.pool = BufferPool(self.context)
+    self.kernels = {}
 
   def build(self,source_filename):
+    """
+    Compile the kernel, with our limits passed in as -D options. Compiled binaries are cached on disk, keyed by a hash of
+    the source code (including the files it includes), the device and driver, and the build options.
+    """
     with open(source_filename, 'r') as f:
       opencl_code = f.read()
-    self.program = cl.Program(self.context,opencl_code).build()
-    #    https://documen.tician.de/pyopencl/runtime_program.html
-    #    build() has optional args about caching compiled code
-    #    "returns self"
+    source_dir = os.path.dirname(os.path.abspath(source_filename))
+    options = list(map(lambda name:f"-D{name}={self.limits[name]}",constants.LIMIT_NAMES))
+    options.append(f"-I{source_dir}")
+    filename = os.path.join(cache.cache_dir('kernels'),self.cache_key(opencl_code,source_dir,options)+'.bin')
+    self.program = None
+    if os.path.exists(filename):
+      with open(filename,'rb') as f:
+        binary = f.read()
+      try:
+        self.program = cl.Program(self.context,[self.device],[binary]).build(options=options)
+      except cl.Error:
+        self.program = None # e.g., the file is corrupted, so fall through and recompile
+    if self.program is None:
+      self.program = cl.Program(self.context,opencl_code).build(options=options)
+      #    https://documen.tician.de/pyopencl/runtime_program.html
+      cache.write_atomically(filename,self.program.get_info(cl.program_info.BINARIES)[0])
     self.queue = cl.CommandQueue(self.context) # does this need to be after we compile?
+    self.kernels = {}
 
+  def cache_key(self,opencl_code,source_dir,options):
+    h = hashlib.sha256()
+    h.update(opencl_code.encode('utf-8'))
+    for header in included_files(opencl_code,source_dir):
+      with open(header,'rb') as f:
+        h.update(f.read())
+    h.update(self.identity().encode('utf-8'))
+    h.update(' '.join(options).encode('utf-8'))
+    return h.hexdigest()
+
+  def identity(self):
+    # A string that identifies the hardware and driver, for keying things that we save on disk.
+    return '|'.join([self.platform.name,self.platform.version,self.device.name,self.device.version,self.device.driver_version])
+
+  def launch_config(self):
+    """
+    Returns a dict with the n_instances and local_size to use when the caller doesn't specify them.
+    """
+    if self.tuning is not None:
+      return {'n_instances':self.tuning['n_instances'],'local_size':self.tuning['local_size']}
+    return {'n_instances':1024,'local_size':64}
+    # ... Without tuning, these are values that should be reasonable on a video card. local_size must divide n_instances,
+    #     and one card preferred local_size to be at least 32. We used to be stuck at 256 instances, because larger values
+    #     caused behavior that smelled like instances modifying each other's memory; that was every work item in a group
+    #     writing the same local arrays at once, which fn_osc() now does cooperatively, with a barrier.
+
+  def kernel(self,name):
+    # Retrieve a kernel once and then reuse it; pyopencl creates a new kernel object every time we do program.name.
+    if name not in self.kernels:
+      self.kernels[name] = cl.Kernel(self.program,name)
+    return self.kernels[name]
+
+  def upload(self,name,host_array,wait_for=None):
+    """
+    Copy a numpy array into the pooled buffer with the given name, without blocking. Returns (name,buffer,event).
+    The array must not be modified or freed until the event is complete.
+    """
+    buf = self.pool.get(name,host_array.nbytes)
+    event = cl.enqueue_copy(self.queue,buf,host_array,is_blocking=False,wait_for=wait_for)
+    return (name,buf,event)
+
+  def zeros(self,name,nbytes,wait_for=None):
+    # Fill the pooled buffer with the given name with zeroes, without blocking. Returns (name,buffer,event).
+    buf = self.pool.get(name,nbytes)
+    event = cl.enqueue_fill_buffer(self.queue,buf,numpy.zeros(1,numpy.int32),0,nbytes,wait_for=wait_for)
+    return (name,buf,event)
+
+  def finish(self):
+    # Wait for everything that has been enqueued.
+    self.queue.finish()
+
+class BufferPool:
+  """
+  Device buffers that are kept around and reused from one run to the next, rather than being allocated every time.
+  Each buffer is identified by a name, such as 'phi_c', and is only reallocated when a bigger one is needed.
+  Since our command queue is in-order, a buffer can be reused by the next run while the previous one is still in flight.
+  """
+  def __init__(self,context):
+    self.context = context
+    self.buffers = {}
+
+  def get(self,name,nbytes):
+    if name in self.buffers and self.buffers[name].size>=nbytes:
+      return self.buffers[name]
+    buf = cl.Buffer(self.context, cl.mem_flags.READ_WRITE, max(nbytes,1))
+    self.buffers[name] = buf
+    return buf
+
+  def clear(self):
+    self.buffers = {}
+
+def included_files(code,source_dir,found=None):
+  # Recursively find the files included by code using #include "...", so that a change in a header invalidates cached binaries.
+  if found is None:
+    found = []
+  for name in re.findall(r'^\s*#include\s+"([^"]+)"',code,flags=re.MULTILINE):
+    filename = os.path.join(source_dir,name)
+    if filename in found or not os.path.exists(filename):
+      continue
+    found.append(filename)
+    with open(filename,'r') as f:
+      included_files(f.read(),source_dir,found)
+  return found
+
+def tuning_filename(identity):
+  return os.path.join(cache.cache_dir('autotune'),hashlib.sha256(identity.encode('utf-8')).hexdigest()[0:16]+'.json')
+
+def load_tuning(identity):
+  # Returns the configuration saved by autotune.py for this device, or None if there isn't one. There is only one per
+  # device, regardless of the shape of the workload; see OpenClDevice.__init__().
+  filename = tuning_filename(identity)
+  if not os.path.exists(filename):
+    return None
+  with open(filename,'r') as f:
+    tuning = json.load(f)
+  if tuning.get('identity')!=identity:
+    return None
+  return tuning
+
+def save_tuning(identity,tuning):
+  tuning = dict(tuning)
+  tuning['identity'] = identity
+  cache.write_atomically(tuning_filename(identity),json.dumps(tuning,indent=2).encode('utf-8'))
@@ -17,12 +17,65 @@
 __kernel void oscillator(__global FLOAT *y,
                          __global int *err, __global int *error_details, __global FLOAT *info,__global int *n_info,
                          __global const FLOAT *v1, __global const FLOAT *v2, __global const FLOAT *v3, __global const FLOAT *v4,
-                         __global const int *k1,  __global const int *k2,
+                         __global const int *k1,  __global const int *k2, __global const FLOAT *mult,
+                         __global const uint *active, __global const int *cursors,
                          __global const long *i_pars, __global const FLOAT *f_pars
                           ) {
   int i = get_global_id(0); // index of the current element in the computational grid
-  err[i] = 0; // see oscillator.py for info about how errors are handled
-  fn_osc(y,i,err,error_details,info,n_info,v1,v2,v3,v4,k1,k2,i_pars,f_pars);
+  // err is zeroed by the host before the launch; see ErrorChannel in oscillator.py for info about how errors are handled
+  // The spline data, staged in local memory by fn_osc():
+  __local int phi_n[MAX_PARTIALS]; // phi_n[m] is the number of knots in the piecewise polynomial for the mth partial's phase
+  __local int a_n[MAX_PARTIALS];
+  __local FLOAT phi_knots[MAX_SPLINE_KNOTS];
+  __local FLOAT a_knots[MAX_SPLINE_KNOTS];
+  __local FLOAT phi_c[MAX_SPLINE_COEFFS];
+  __local FLOAT a_c[MAX_SPLINE_COEFFS];
+  __local FLOAT mult_local[MAX_PARTIALS];
+  fn_osc(y,i,get_local_id(0),get_local_size(0),err,error_details,info,n_info,v1,v2,v3,v4,k1,k2,mult,active,cursors,
+         i_pars,f_pars,
+         phi_n,a_n,phi_knots,a_knots,phi_c,a_c,mult_local);
+}
+
+__kernel void oscillator_batch(__global FLOAT *y,
+                         __global int *err, __global int *error_details,
+                         __global const FLOAT *v1, __global const FLOAT *v2, __global const FLOAT *v3, __global const FLOAT *v4,
+                         __global const int *partial_i, __global const int *note_i, __global const FLOAT *note_f,
+                         __global const int *inst_notes_start, __global const int *inst_notes,
+                         __global const long *i_pars, __global const FLOAT *f_pars
+                          ) {
+  int i = get_global_id(0);
+  fn_osc_batch(y,i,err,error_details,v1,v2,v3,v4,partial_i,note_i,note_f,inst_notes_start,inst_notes,i_pars,f_pars);
+}
+
+__kernel void oscillator_windowed(__global FLOAT *y,
+                         __global int *err, __global int *error_details,
+                         __global const FLOAT *v1, __global const FLOAT *v2, __global const FLOAT *v3, __global const FLOAT *v4,
+                         __global const int *partial_i, __global const int *window_i,
+                         __global const long *i_pars, __global const FLOAT *f_pars
+                          ) {
+  // The window of each spline that this workgroup needs, staged in local memory by fn_osc_windowed():
+  __local int phi_n[MAX_PARTIALS];
+  __local int a_n[MAX_PARTIALS];
+  __local FLOAT phi_knots[MAX_SPLINE_KNOTS];
+  __local FLOAT a_knots[MAX_SPLINE_KNOTS];
+  __local FLOAT phi_c[MAX_SPLINE_COEFFS];
+  __local FLOAT a_c[MAX_SPLINE_COEFFS];
+  fn_osc_windowed(y,get_global_id(0),get_group_id(0),get_local_id(0),get_local_size(0),err,error_details,
+                  v1,v2,v3,v4,partial_i,window_i,i_pars,f_pars,phi_n,a_n,phi_knots,a_knots,phi_c,a_c);
+}
+
+__kernel void oscillator_2d(__global FLOAT *y,
+                         __global int *err, __global int *error_details,
+                         __global const FLOAT *v1, __global const FLOAT *v2, __global const FLOAT *v3, __global const FLOAT *v4,
+                         __global const int *k1,  __global const int *k2, __global const FLOAT *mult,
+                         __global const uint *active,
+                         __global const long *i_pars, __global const FLOAT *f_pars
+                          ) {
+  // Used by fn_osc_2d() for the offsets of the partials' data and for adding up the lanes:
+  __local int offsets[4*MAX_PARTIALS];
+  __local FLOAT sums[MAX_LOCAL_2D];
+  fn_osc_2d(y,get_global_id(0),get_group_id(0),get_local_id(0),get_local_size(0),get_local_id(1),get_local_size(1),
+            err,error_details,v1,v2,v3,v4,k1,k2,mult,active,i_pars,f_pars,offsets,sums);
 }
 
 #endif
@@ -30,70 +83,75 @@ __kernel void oscillator(__global FLOAT *y,
 #define ERR(error_array,instance,err) flag_err(error_array,instance,err,__LINE__)
 // ... see oscillator.py for info about how errors are handled
 
-void fn_osc(__global FLOAT *y,int i,
+#define IS_ACTIVE(active,m) ((active)==0 || (((active)[(m)/32]>>((m)%32))&1))
+// ... Whether partial m needs to be computed. active is a bit mask with ACTIVE_MASK_WORDS words for the current instance, made
+//     by active_partials() in oscillator.py, which leaves out partials that are above the Nyquist frequency or inaudibly
+//     quiet for the whole time range covered by the instance. If active is 0, then all partials are active.
+
+/*
+  i_pars[5] is the mode:
+    OSC_MODE_GENERAL = every partial has its own phase spline
+    OSC_MODE_HARMONIC = there is only one phase spline, phi, and the phase of partial m is mult[m]*phi; see HarmonicStack
+            in partial.py
+    OSC_MODE_RECURRENCE = same as OSC_MODE_HARMONIC, but the multipliers are integers in increasing order, which lets us
+            avoid calling sin() for every partial; see oscillator_recurrence_one_block()
+*/
+void fn_osc(__global FLOAT *y,int i,int lid,int lsize,
                          __global int *err, __global int *error_details, __global FLOAT *info,__global int *n_info,
                          __global const FLOAT *v1, __global const FLOAT *v2,
                          __global const FLOAT *v3, __global const FLOAT *v4,
-                         __global const int *k1,  __global const int *k2,
-                         __global const long *i_pars, __global const FLOAT *f_pars) {
+                         __global const int *k1,  __global const int *k2, __global const FLOAT *mult,
+                         __global const uint *active, __global const int *cursors,
+                         __global const long *i_pars, __global const FLOAT *f_pars,
+                         __local int *phi_n, __local int *a_n, __local FLOAT *phi_knots, __local FLOAT *a_knots,
+                         __local FLOAT *phi_c_local, __local FLOAT *a_c_local, __local FLOAT *mult_local) {
   int j1;
   int j2;
-  __local int samples_per_instance;
-  __local int n_partials;
-  __local int n_samples;
-  samples_per_instance = i_pars[0];
-  n_partials = i_pars[1];
-  n_samples = i_pars[2];
-  // copy data to local memory for efficiency:
-  __local int phi_n[MAX_PARTIALS]; // phi_n[m] is the number of knots in the piecewise polynomial for the mth partial's phase
-  __local int a_n[MAX_PARTIALS];
-  __local FLOAT phi_knots[MAX_SPLINE_KNOTS];
-  __local FLOAT a_knots[MAX_SPLINE_KNOTS];
-  __local FLOAT phi_c_local[MAX_SPLINE_COEFFS];
-  __local FLOAT a_c_local[MAX_SPLINE_COEFFS];
-  DEBUG(if (!(samples_per_instance>0 && n_partials>0)) {ERR(err,i,HONK_ERR_ILLEGAL_VALUE); return;}) // sanity check
-  // ---- copy number of knots
-  if (n_partials>MAX_PARTIALS) {ERR(err,i,HONK_ERR_TOO_MANY_PARTIALS); return;}
-  for (int m=0; m<n_partials; m++) {
-    phi_n[m] = k1[m];
+  int samples_per_instance = i_pars[0];
+  int n_partials = i_pars[1];
+  int n_samples = i_pars[2];
+  int mode = i_pars[5];
+  int n_phi_splines = (mode==OSC_MODE_GENERAL ? n_partials : 1);
+  // ---- figure out how much data there is
+  // Every work item in the group gets the same answers. Any error is only reported after the barrier below, since every work
+  // item has to reach it, even if they would all return.
+  int staging_err = 0;
+  DEBUG(if (!(samples_per_instance>0 && n_partials>0)) {staging_err = HONK_ERR_ILLEGAL_VALUE;}) // sanity check
+  if (n_partials>MAX_PARTIALS) {staging_err = HONK_ERR_TOO_MANY_PARTIALS;}
+  int n_phi_knots = 0;
+  int n_a_knots = 0;
+  for (int m=0; m<n_partials && !staging_err; m++) {
+    n_phi_knots += (m<n_phi_splines ? k1[m] : 0);
+    n_a_knots += k2[m];
+  }
+  if (n_phi_knots>MAX_SPLINE_KNOTS || n_a_knots>MAX_SPLINE_KNOTS) {staging_err = HONK_ERR_TOO_MANY_KNOTS_IN_SPLINE;}
+  // n-1 coefficients per spline because there are no coeffs associated with rightmost knot
+  int n_phi_c = (n_phi_knots-n_phi_splines)*(PHASE_SPLINE_ORDER+1);
+  int n_a_c = (n_a_knots-n_partials)*(A_SPLINE_ORDER+1);
+  if (n_phi_c>MAX_SPLINE_COEFFS || n_a_c>MAX_SPLINE_COEFFS) {staging_err = HONK_ERR_SPLINE_TOO_LARGE;}
+  if (staging_err) {n_partials = n_phi_knots = n_a_knots = n_phi_c = n_a_c = 0;} // don't copy anything
+  // ---- copy data to local memory for efficiency
+  // The data for all the partials are concatenated in v1...v4, so the work items in the group can copy them as flat arrays,
+  // each one doing every lsize-th element, and then wait for each other at the barrier.
+  for (int m=lid; m<n_partials; m+=lsize) {
+    phi_n[m] = (m<n_phi_splines ? k1[m] : 1); // 1 means no data, since there are no coefficients for the last knot
     a_n[m]   = k2[m];
-    if (phi_n[m]>MAX_SPLINE_KNOTS || a_n[m]>MAX_SPLINE_KNOTS) {ERR(err,i,HONK_ERR_TOO_MANY_KNOTS_IN_SPLINE); return;}
+    mult_local[m] = mult[m];
   }
-  // ---- copy locations of knots
-  int k_phi = 0;
-  int k_a = 0;
-  for (int m=0; m<n_partials; m++) {
-    int this_phi_n = phi_n[m];
-    int this_a_n = a_n[m];
-    if (k_phi+this_phi_n>MAX_SPLINE_KNOTS || k_a+this_a_n>MAX_SPLINE_KNOTS) {ERR(err,i,HONK_ERR_TOO_MANY_KNOTS_IN_SPLINE); return;}
-    for (int j=0; j<this_phi_n; j++) {
-      DEBUG(if (k_phi+j>MAX_SPLINE_KNOTS) {ERR(err,i,HONK_ERR_INDEX_OUT_OF_RANGE);return;})
-      phi_knots[k_phi+j] = v2[k_phi+j];
-    }
-    for (int j=0; j<this_a_n; j++) {
-      a_knots[k_a+j]     = v4[k_a+j];
-    }
-    k_phi += this_phi_n;
-    k_a   += this_a_n;
+  for (int j=lid; j<n_phi_knots; j+=lsize) {
+    phi_knots[j] = v2[j];
   }
-  // ---- copy coefficients of cubic spline polynomials
-  k_phi = 0;
-  k_a = 0;
-  for (int m=0; m<n_partials; m++) {
-    int this_phi_n = phi_n[m];
-    int this_a_n = a_n[m];
-    int phi_size = (this_phi_n-1)*(PHASE_SPLINE_ORDER+1); // n-1 because there are no coeffs associated with rightmost knot
-    int a_size =     (this_a_n-1)    *(A_SPLINE_ORDER+1);
-    if (k_phi+phi_size>MAX_SPLINE_COEFFS || k_a+a_size>MAX_SPLINE_COEFFS) {ERR(err,i,HONK_ERR_SPLINE_TOO_LARGE); return;}
-    for (int j=0; j<phi_size; j++) {
-      phi_c_local[k_phi+j] = v1[k_phi+j];
-    }
-    for (int j=0; j<a_size; j++) {
-      a_c_local[k_a+j]     = v3[k_a+j];
-    }
-    k_phi += phi_size;
-    k_a     += a_size;
+  for (int j=lid; j<n_a_knots; j+=lsize) {
+    a_knots[j] = v4[j];
   }
+  for (int j=lid; j<n_phi_c; j+=lsize) {
+    phi_c_local[j] = v1[j];
+  }
+  for (int j=lid; j<n_a_c; j+=lsize) {
+    a_c_local[j] = v3[j];
+  }
+  barrier(CLK_LOCAL_MEM_FENCE);
+  if (staging_err) {ERR(err,i,staging_err); return;}
   j1 = i*samples_per_instance;
   j2 = (i+1)*samples_per_instance-1;
   if (j1>=n_samples) {return;} // this can happen and is OK; we made an instance that we didn't need; could work on oscillator.py to make this
@@ -105,25 +163,38 @@ void fn_osc(__global FLOAT *y,int i,
   DEBUG(if (!(j2>=j1)) {set_flags(error_details,i,j1,j2,samples_per_instance); ERR(err,i,HONK_ERR_ILLEGAL_VALUE); return;})
   DEBUG(if (!(j1>=0 && j2>=0 && j2>=j1 && samples_per_instance>0)) {set_flags(error_details,i,j1,(int) sizeof(j1),samples_per_instance); ERR(err,i,HONK_ERR_ILLEGAL_VALUE); return;}) // sanity check
   DEBUG(if (j1>=n_samples) {set_flags(error_details,i,j1,j2,n_samples); ERR(err,i,HONK_ERR_INDEX_OUT_OF_RANGE); return;}) // sanity check
-  oscillator_cubic_spline(y,err,error_details,i,
+  // Several launches can write into the same output buffer: each one writes to y starting at the offset i_pars[3],
+  // and if i_pars[4] is nonzero it adds to what's already there rather than overwriting it.
+  oscillator_cubic_spline(y+i_pars[3],i_pars[4],err,error_details,i,
                           phi_c_local,phi_knots,phi_n,
                           a_c_local,    a_knots    ,a_n,
+                          mode,mult_local,active+ACTIVE_MASK_WORDS*i,
+                          cursors+2*n_partials*i,i_pars[6], // see knot_cursors() in oscillator.py, and spline_block()
                           f_pars[0],f_pars[1],j1,j2,n_partials
                          );
 }
 
 
 
-// For efficiency, break the calculation into small blocks, so that each block can fit in private memory.
-#define BLOCK_SIZE 64
-// ... Has to be small enough so that we can have a private array of floats of this size. Seems to run OK with values as big as 512.
-//     Bigger sizes are slightly more efficient. For a sound with 8 partials, a block size of 4 was significantly better than 1,
-//     but bigger sizes were no better. For sounds with a lot of partials, big block sizes are likely to help.
-void oscillator_cubic_spline(__global FLOAT *y,__global int *err,__global int *error_details,int instance,
+// For efficiency, break the calculation into small blocks of BLOCK_SIZE samples, so that each block can fit in private memory;
+// see constants.h.
+// cursors[2*m] and cursors[2*m+1] are the knot intervals of partial m's phase and amplitude splines at our first sample, as
+// worked out by knot_cursors() in oscillator.py, or cursors can be 0, meaning start from the first knot. From then on, each
+// block picks up where the one before it left off, so we never rescan a spline from its beginning.
+// If incremental is nonzero, the splines are evaluated by forward differences; see spline_block().
+void oscillator_cubic_spline(__global FLOAT *y,int accumulate,__global int *err,__global int *error_details,int instance,
                              __local FLOAT *phi_c,__local FLOAT *phi_knots,__local int *phi_n,
                              __local FLOAT *a_c,    __local FLOAT *a_knots,    __local int *a_n,
+                             int mode,__local FLOAT *mult,__global const uint *active,
+                             __global const int *cursors,int incremental,
                              FLOAT t0,FLOAT dt,int j1,int j2,int n_partials) {
   FLOAT y_private[BLOCK_SIZE];
+  int phi_i[MAX_PARTIALS];
+  int a_i[MAX_PARTIALS];
+  for (int m=0; m<n_partials; m++) {
+    phi_i[m] = (cursors==0 ? 0 : cursors[2*m]);
+    a_i[m]   = (cursors==0 ? 0 : cursors[2*m+1]);
+  }
   int n_blocks = (j2-j1+1)/BLOCK_SIZE;
   if (n_blocks*BLOCK_SIZE<j2-j1+1) {++n_blocks;}
   for (int b=0; b<n_blocks; b++) {
@@ -131,20 +202,46 @@ void oscillator_cubic_spline(__global FLOAT *y,__global int *err,__global int *e
     subj1 = j1+b*BLOCK_SIZE;
     subj2 = j1+(b+1)*BLOCK_SIZE-1;
     if (subj2>j2) {subj2=j2;}
-    oscillator_cubic_spline_one_block(y_private,err,error_details,instance,phi_c,phi_knots,phi_n,a_c,a_knots,a_n,
-                                      t0+subj1*dt,dt,0,subj2-subj1,n_partials);
-    for (int j=subj1; j<=subj2; j++) {
-      y[j] = y_private[j-subj1];
+    int local_err;
+    if (mode==OSC_MODE_RECURRENCE) {
+      local_err = oscillator_recurrence_one_block(y_private,phi_c,phi_knots,phi_n,a_c,a_knots,a_n,mult,active,phi_i,a_i,
+                                      incremental,t0+subj1*dt,dt,subj2-subj1+1,n_partials);
+    }
+    else if (mode==OSC_MODE_HARMONIC) {
+      local_err = oscillator_harmonic_one_block(y_private,phi_c,phi_knots,phi_n,a_c,a_knots,a_n,mult,active,phi_i,a_i,
+                                      incremental,t0+subj1*dt,dt,subj2-subj1+1,n_partials);
+    }
+    else {
+      local_err = oscillator_cubic_spline_one_block(y_private,phi_c,phi_knots,phi_n,a_c,a_knots,a_n,active,phi_i,a_i,
+                                      incremental,t0+subj1*dt,dt,subj2-subj1+1,n_partials);
+    }
+    if (local_err) {ERR(err,instance,local_err); return;}
+    if (accumulate) {
+      for (int j=subj1; j<=subj2; j++) {
+        y[j] += y_private[j-subj1];
+      }
+    }
+    else {
+      for (int j=subj1; j<=subj2; j++) {
+        y[j] = y_private[j-subj1];
+      }
     }
   }
 }
 
-void oscillator_cubic_spline_one_block(FLOAT *y,__global int *err,__global int *error_details,int instance,
+/*
+  The following three functions do one block of n samples, starting at time t0, and put the results in y[0]...y[n-1].
+  phi_i[m] and a_i[m] are the knot cursors for partial m, which are updated as we go. The return value is 0, or an error code.
+*/
+
+int oscillator_cubic_spline_one_block(FLOAT *y,
                              __local FLOAT *phi_c,__local FLOAT *phi_knots,__local int *phi_n,
                              __local FLOAT *a_c,    __local FLOAT *a_knots,    __local int *a_n,
-                             FLOAT t0,FLOAT dt,int j1,int j2,int n_partials) {
-  FLOAT phi,a,t;
-  for (int j=j1; j<=j2; j++) {
+                             __global const uint *active,int *phi_i,int *a_i,
+                             int incremental,FLOAT t0,FLOAT dt,int n,int n_partials) {
+  FLOAT phi_private[BLOCK_SIZE];
+  FLOAT a_private[BLOCK_SIZE];
+  for (int j=0; j<n; j++) {
     y[j] = 0.0;
   }
   int this_phi_c = 0;
@@ -154,22 +251,481 @@ void oscillator_cubic_spline_one_block(FLOAT *y,__global int *err,__global int *
   for (int m=0; m<n_partials; m++) {
     int this_phi_n = phi_n[m];
     int this_a_n = a_n[m];
-    int phi_i = 0; // current knot number in spline for phi
-    int a_i = 0;     // ... similar
-    for (int j=j1; j<=j2; j++) {
-      t = t0 + dt*j;
-      int local_err; 
-      phi = spline(phi_c+this_phi_c,phi_knots+this_phi_knots,this_phi_n,PHASE_SPLINE_ORDER,&phi_i,t,&local_err);
-      if (local_err) {ERR(err,instance,local_err); return;}
-      a     = spline(a_c+this_a_c,  a_knots+this_a_knots,    this_a_n,    A_SPLINE_ORDER,&a_i,    t,&local_err);
-      if (local_err) {ERR(err,instance,local_err); return;}
-      y[j] += a*sin(phi);
+    if (IS_ACTIVE(active,m)) {
+      int local_err;
+      local_err = spline_block(phi_c+this_phi_c,phi_knots+this_phi_knots,this_phi_n,PHASE_SPLINE_ORDER,phi_i+m,t0,dt,n,
+                               incremental,phi_private);
+      if (local_err) {return local_err;}
+      local_err = spline_block(a_c+this_a_c,a_knots+this_a_knots,this_a_n,A_SPLINE_ORDER,a_i+m,t0,dt,n,incremental,a_private);
+      if (local_err) {return local_err;}
+      for (int j=0; j<n; j++) {
+        y[j] += a_private[j]*sin(phi_private[j]);
+      }
     }
     this_phi_knots += this_phi_n;
     this_a_knots     += this_a_n;
     this_phi_c += (this_phi_n-1)*(PHASE_SPLINE_ORDER+1); // n-1 because there are no coeffs associated with rightmost knot
     this_a_c     += (this_a_n-1)    *(A_SPLINE_ORDER+1);
   }
+  return 0;
+}
+
+/*
+  Same as oscillator_cubic_spline_one_block, but for OSC_MODE_HARMONIC, where all the partials share one phase spline, whose
+  data are those for partial 0. The phase is evaluated only once per sample, and then each partial multiplies it by its own
+  multiplier.
+*/
+int oscillator_harmonic_one_block(FLOAT *y,
+                             __local FLOAT *phi_c,__local FLOAT *phi_knots,__local int *phi_n,
+                             __local FLOAT *a_c,    __local FLOAT *a_knots,    __local int *a_n,
+                             __local FLOAT *mult,__global const uint *active,int *phi_i,int *a_i,
+                             int incremental,FLOAT t0,FLOAT dt,int n,int n_partials) {
+  FLOAT phi_private[BLOCK_SIZE];
+  FLOAT a_private[BLOCK_SIZE];
+  int local_err;
+  local_err = spline_block(phi_c,phi_knots,phi_n[0],PHASE_SPLINE_ORDER,phi_i,t0,dt,n,incremental,phi_private);
+  if (local_err) {return local_err;}
+  for (int j=0; j<n; j++) {
+    y[j] = 0.0;
+  }
+  int this_a_c = 0;
+  int this_a_knots = 0;
+  for (int m=0; m<n_partials; m++) {
+    int this_a_n = a_n[m];
+    FLOAT this_mult = mult[m];
+    if (IS_ACTIVE(active,m)) {
+      local_err = spline_block(a_c+this_a_c,a_knots+this_a_knots,this_a_n,A_SPLINE_ORDER,a_i+m,t0,dt,n,incremental,a_private);
+      if (local_err) {return local_err;}
+      for (int j=0; j<n; j++) {
+        y[j] += a_private[j]*sin(this_mult*phi_private[j]);
+      }
+    }
+    this_a_knots += this_a_n;
+    this_a_c     += (this_a_n-1)*(A_SPLINE_ORDER+1);
+  }
+  return 0;
+}
+
+/*
+  Same as oscillator_harmonic_one_block, but for OSC_MODE_RECURRENCE, where the multipliers are integers n in increasing order.
+  Rather than calling sin(n*phi) for every partial, we get it from the ones for n-1 and n-2 using the recurrence
+  sin(n*phi) = 2cos(phi)sin((n-1)*phi)-sin((n-2)*phi), which only takes a multiply and a subtract. Rounding errors build up
+  as we go, so every RECURRENCE_ANCHOR harmonics, and whenever there's a big gap in the multipliers, we start over from
+  values of sin() that are computed directly.
+*/
+int oscillator_recurrence_one_block(FLOAT *y,
+                             __local FLOAT *phi_c,__local FLOAT *phi_knots,__local int *phi_n,
+                             __local FLOAT *a_c,    __local FLOAT *a_knots,    __local int *a_n,
+                             __local FLOAT *mult,__global const uint *active,int *phi_i,int *a_i,
+                             int incremental,FLOAT t0,FLOAT dt,int n_samples,int n_partials) {
+  FLOAT phi_private[BLOCK_SIZE];
+  FLOAT a_private[BLOCK_SIZE];
+  FLOAT two_cos[BLOCK_SIZE]; // 2cos(phi)
+  FLOAT s[BLOCK_SIZE]; // sin(n*phi)
+  FLOAT s_prev[BLOCK_SIZE]; // sin((n-1)*phi)
+  int local_err;
+  local_err = spline_block(phi_c,phi_knots,phi_n[0],PHASE_SPLINE_ORDER,phi_i,t0,dt,n_samples,incremental,phi_private);
+  if (local_err) {return local_err;}
+  for (int j=0; j<n_samples; j++) {
+    two_cos[j] = 2.0*cos(phi_private[j]);
+    y[j] = 0.0;
+  }
+  int n = 0; // the harmonic that s is currently for
+  int n_anchor = 0; // the last one for which we computed s directly
+  int this_a_c = 0;
+  int this_a_knots = 0;
+  for (int m=0; m<n_partials; m++) {
+    int this_a_n = a_n[m];
+    if (!IS_ACTIVE(active,m)) {
+      this_a_knots += this_a_n;
+      this_a_c     += (this_a_n-1)*(A_SPLINE_ORDER+1);
+      continue; // the next active partial will pick up the recurrence from where we are now
+    }
+    int target = (int) mult[m];
+    if (n==0 || target-n_anchor>=RECURRENCE_ANCHOR) {
+      for (int j=0; j<n_samples; j++) {
+        s[j] = sin(target*phi_private[j]);
+        s_prev[j] = sin((target-1)*phi_private[j]);
+      }
+      n = target;
+      n_anchor = target;
+    }
+    for (; n<target; n++) {
+      for (int j=0; j<n_samples; j++) {
+        FLOAT s_next = two_cos[j]*s[j]-s_prev[j];
+        s_prev[j] = s[j];
+        s[j] = s_next;
+      }
+    }
+    local_err = spline_block(a_c+this_a_c,a_knots+this_a_knots,this_a_n,A_SPLINE_ORDER,a_i+m,t0,dt,n_samples,incremental,
+                             a_private);
+    if (local_err) {return local_err;}
+    for (int j=0; j<n_samples; j++) {
+      y[j] += a_private[j]*s[j];
+    }
+    this_a_knots += this_a_n;
+    this_a_c     += (this_a_n-1)*(A_SPLINE_ORDER+1);
+  }
+  return 0;
+}
+
+/*
+  Evaluate a spline, in the same format as for spline(), at the n_out points x0, x0+h, ..., and put the results in out.
+  *i is a knot cursor, as for spline(), and gets updated. Returns 0, or an error code.
+  If incremental is zero, we just call spline() for each point. Otherwise, within each interval between knots, we step along
+  using forward differences, which takes k additions per point rather than the k multiplications and k additions of Horner's
+  rule, and then start over at the next knot, so that rounding errors don't have long to build up. To keep them small, what
+  we step along is the change since the first point of the run, which starts from zero, and the value there is added back
+  in at the end: first the part that comes from the polynomial's constant term, then the rest. For the phase, both of these
+  are typically much bigger than the change over one block, and accumulating the steps onto them would round at every step.
+*/
+int spline_block(__local FLOAT *c,__local FLOAT *knots,int n,int k,int *i,FLOAT x0,FLOAT h,int n_out,int incremental,
+                 FLOAT *out) {
+  int local_err;
+  if (!incremental) {
+    for (int j=0; j<n_out; j++) {
+      out[j] = spline(c,knots,n,k,i,x0+h*j,&local_err);
+      if (local_err) {return local_err;}
+    }
+    return 0;
+  }
+  DEBUG(if (*i<0 || *i>=n-1) {return HONK_ERR_INDEX_OUT_OF_RANGE;})
+  int j = 0;
+  while (j<n_out) {
+    FLOAT x = x0+h*j;
+    while (*i<=n-3 && x>knots[*i+1]) {(*i)++;} // same choice of interval as in spline()
+    FLOAT d = x-knots[*i];
+    DEBUG(if (isnan(knots[*i])) {return HONK_ERR_NAN;})
+    if (d<0) {return HONK_ERR_ILLEGAL_VALUE;}
+    int j_end = n_out; // exclusive
+    if (*i<=n-3) {
+      int n_in = (int) ((knots[*i+1]-x)/h)+1; // number of points, starting from this one, that are still in this interval
+      if (j+n_in<j_end) {j_end = j+n_in;}
+    }
+    FLOAT diff[PHASE_SPLINE_ORDER+1];
+    forward_differences(c,n,k,*i,d,h,diff);
+    FLOAT c0 = c[(n-1)*k+*i];
+    FLOAT b0 = diff[0]; // the value at x, minus c0
+    diff[0] = 0.0;
+    for (; j<j_end; j++) {
+      out[j] = c0+(b0+diff[0]);
+      for (int m=0; m<k; m++) {
+        diff[m] += diff[m+1];
+      }
+    }
+  }
+  return 0;
+}
+
+// forward_difference_table[m][e] = mth forward difference of s^e at s=0, which is m! times a Stirling number of the second kind
+__constant FLOAT forward_difference_table[5][5] = {{1,0,0,0,0},{0,1,1,1,1},{0,0,2,6,14},{0,0,0,6,36},{0,0,0,0,24}};
+__constant FLOAT binomial_table[5][5] = {{1,0,0,0,0},{1,1,0,0,0},{1,2,1,0,0},{1,3,3,1,0},{1,4,6,4,1}};
+
+/*
+  For the polynomial on interval i of a spline (same format as for spline()), minus its constant term, find the value and
+  the forward differences at the point that is a distance d to the right of knot i, with step size h. The results go in
+  diff[0]...diff[k], where diff[0] is the value and diff[m] is the mth difference. We first write the polynomial as
+  b_0+b_1s+b_2s^2+..., where s counts steps from our starting point, and then get the differences from the b's, which is
+  much more accurate than taking differences of values of the polynomial. Only works for k<=4.
+*/
+void forward_differences(__local FLOAT *c,int n,int k,int i,FLOAT d,FLOAT h,FLOAT *diff) {
+  FLOAT b[PHASE_SPLINE_ORDER+1];
+  FLOAT h_e = 1.0; // h^e
+  for (int e=0; e<=k; e++) {
+    // Taylor series: b_e = h^e sum_{p>=e} C(p,e) a_p d^(p-e), where a_p = c[(n-1)(k-p)+i] is the coefficient of d^p
+    FLOAT s = 0.0;
+    for (int p=k; p>=e && p>=1; p--) {
+      s = s*d+binomial_table[p][e]*c[(n-1)*(k-p)+i];
+    }
+    if (e==0) {s = s*d;} // leaving out the constant term a_0
+    b[e] = s*h_e;
+    h_e *= h;
+  }
+  for (int m=0; m<=k; m++) {
+    diff[m] = 0.0;
+    for (int e=m; e<=k; e++) {
+      diff[m] += forward_difference_table[m][e]*b[e];
+    }
+  }
+}
+
+/*
+  Many notes, each with its own partials, mixed into a single output buffer y. This is like fn_osc, but the spline data
+  stay in global memory, since there are typically far too many knots in a whole score to fit in local memory.
+  The layout of the inputs is described in OscillatorBatch in oscillator.py:
+    v1...v4 = phi_c, phi_knots, a_c, a_knots, flattened and concatenated for all partials of all notes
+    partial_i[PARTIAL_I_SIZE*p+...] = number of phi knots, number of a knots, and offsets into v1...v4 for partial p
+    note_i[NOTE_I_SIZE*k+...] = first partial, number of partials, offset in y, and number of samples for note k
+    note_f[k] = time, in the note's own time variable, at which note k starts
+    inst_notes[inst_notes_start[i]] ... inst_notes[inst_notes_start[i+1]-1] = the notes that overlap the samples done by instance i
+*/
+void fn_osc_batch(__global FLOAT *y,int i,
+                         __global int *err, __global int *error_details,
+                         __global const FLOAT *v1, __global const FLOAT *v2, __global const FLOAT *v3, __global const FLOAT *v4,
+                         __global const int *partial_i, __global const int *note_i, __global const FLOAT *note_f,
+                         __global const int *inst_notes_start, __global const int *inst_notes,
+                         __global const long *i_pars, __global const FLOAT *f_pars) {
+  int samples_per_instance = i_pars[0];
+  int n_samples = i_pars[2];
+  FLOAT dt = f_pars[0];
+  FLOAT y_private[BLOCK_SIZE];
+  DEBUG(if (!(samples_per_instance>0)) {ERR(err,i,HONK_ERR_ILLEGAL_VALUE); return;}) // sanity check
+  int j1 = i*samples_per_instance;
+  int j2 = (i+1)*samples_per_instance-1;
+  if (j1>=n_samples) {return;} // an instance that we didn't need
+  if (j2>=n_samples) {j2=n_samples-1;}
+  int k1 = inst_notes_start[i];
+  int k2 = inst_notes_start[i+1]; // exclusive
+  for (int subj1=j1; subj1<=j2; subj1+=BLOCK_SIZE) {
+    int subj2 = subj1+BLOCK_SIZE-1;
+    if (subj2>j2) {subj2=j2;}
+    for (int j=0; j<=subj2-subj1; j++) {
+      y_private[j] = 0.0;
+    }
+    for (int kk=k1; kk<k2; kk++) {
+      int k = inst_notes[kk];
+      int first_partial = note_i[NOTE_I_SIZE*k];
+      int n_partials    = note_i[NOTE_I_SIZE*k+1];
+      int offset        = note_i[NOTE_I_SIZE*k+2];
+      int note_n        = note_i[NOTE_I_SIZE*k+3];
+      int lo = subj1;
+      int hi = subj2;
+      if (offset>lo) {lo=offset;}
+      if (offset+note_n-1<hi) {hi=offset+note_n-1;}
+      if (lo>hi) {continue;} // note doesn't overlap this block
+      FLOAT t_lo = note_f[k]+dt*(lo-offset);
+      for (int p=first_partial; p<first_partial+n_partials; p++) {
+        __global const int *q = partial_i+PARTIAL_I_SIZE*p;
+        int phi_n = q[0];
+        int a_n = q[1];
+        __global const FLOAT *phi_c = v1+q[2];
+        __global const FLOAT *phi_knots = v2+q[3];
+        __global const FLOAT *a_c = v3+q[4];
+        __global const FLOAT *a_knots = v4+q[5];
+        int phi_i = find_knot_global(phi_knots,phi_n,t_lo);
+        int a_i   = find_knot_global(a_knots,a_n,t_lo);
+        for (int j=lo; j<=hi; j++) {
+          FLOAT t = t_lo+dt*(j-lo);
+          int local_err;
+          FLOAT phi = spline_global(phi_c,phi_knots,phi_n,PHASE_SPLINE_ORDER,&phi_i,t,&local_err);
+          if (local_err) {ERR(err,i,local_err); return;}
+          FLOAT a   = spline_global(a_c,  a_knots,  a_n,  A_SPLINE_ORDER,    &a_i,  t,&local_err);
+          if (local_err) {ERR(err,i,local_err); return;}
+          y_private[j-subj1] += a*sin(phi);
+        }
+      }
+    }
+    for (int j=subj1; j<=subj2; j++) {
+      y[j] = y_private[j-subj1];
+    }
+  }
+}
+
+/*
+  Like fn_osc, but for a note whose splines have too many knots to fit in local memory all at once. The spline data stay in
+  global memory, in the same format as for fn_osc_batch, and each workgroup copies into local memory only the window of
+  each spline that covers the samples it's responsible for. The windows are computed by OscillatorWindowed in oscillator.py:
+    partial_i[PARTIAL_I_SIZE*p+...] = number of phi knots, number of a knots, and offsets into v1...v4 for partial p
+    window_i[WINDOW_I_SIZE*(group*n_partials+p)+...] = index of the first phi knot in the window, number of phi knots in
+            the window, and the same for a
+  i = global id, group = group id, lid = local id, lsize = local size
+  Once they've been staged, the windows are in the same format as the data that fn_osc copies into local memory, so that
+  the actual synthesis is done by the same code.
+*/
+void fn_osc_windowed(__global FLOAT *y,int i,int group,int lid,int lsize,
+                         __global int *err, __global int *error_details,
+                         __global const FLOAT *v1, __global const FLOAT *v2, __global const FLOAT *v3, __global const FLOAT *v4,
+                         __global const int *partial_i, __global const int *window_i,
+                         __global const long *i_pars, __global const FLOAT *f_pars,
+                         __local int *phi_n, __local int *a_n, __local FLOAT *phi_knots, __local FLOAT *a_knots,
+                         __local FLOAT *phi_c, __local FLOAT *a_c) {
+  int samples_per_instance = i_pars[0];
+  int n_partials = i_pars[1];
+  int n_samples = i_pars[2];
+  // All the work items in the group cooperate in copying the windows, each one doing every lsize-th element.
+  // The checks against the limits give the same result for every work item in the group. As in fn_osc, errors are only
+  // reported after the barrier, which every work item has to reach.
+  int staging_err = 0;
+  DEBUG(if (!(samples_per_instance>0 && n_partials>0)) {staging_err = HONK_ERR_ILLEGAL_VALUE;}) // sanity check
+  if (n_partials>MAX_PARTIALS) {staging_err = HONK_ERR_TOO_MANY_PARTIALS;}
+  __global const int *w = window_i+WINDOW_I_SIZE*group*n_partials;
+  int k_phi = 0; // offsets into the local arrays
+  int k_a = 0;
+  int kc_phi = 0;
+  int kc_a = 0;
+  for (int m=0; m<n_partials && !staging_err; m++) {
+    __global const int *q = partial_i+PARTIAL_I_SIZE*m;
+    int phi_first = w[WINDOW_I_SIZE*m];
+    int this_phi_n = w[WINDOW_I_SIZE*m+1];
+    int a_first = w[WINDOW_I_SIZE*m+2];
+    int this_a_n = w[WINDOW_I_SIZE*m+3];
+    int phi_size = (this_phi_n-1)*(PHASE_SPLINE_ORDER+1);
+    int a_size = (this_a_n-1)*(A_SPLINE_ORDER+1);
+    if (k_phi+this_phi_n>MAX_SPLINE_KNOTS || k_a+this_a_n>MAX_SPLINE_KNOTS) {staging_err = HONK_ERR_TOO_MANY_KNOTS_IN_SPLINE; break;}
+    if (kc_phi+phi_size>MAX_SPLINE_COEFFS || kc_a+a_size>MAX_SPLINE_COEFFS) {staging_err = HONK_ERR_SPLINE_TOO_LARGE; break;}
+    if (lid==0) {
+      phi_n[m] = this_phi_n;
+      a_n[m] = this_a_n;
+    }
+    for (int j=lid; j<this_phi_n; j+=lsize) {
+      phi_knots[k_phi+j] = v2[q[3]+phi_first+j];
+    }
+    for (int j=lid; j<this_a_n; j+=lsize) {
+      a_knots[k_a+j] = v4[q[5]+a_first+j];
+    }
+    // Coefficient c[mm][ii] of the whole spline is at mm*(n-1)+ii, and in the window it goes at mm*(window n-1)+ii-first.
+    for (int j=lid; j<phi_size; j+=lsize) {
+      int mm = j/(this_phi_n-1);
+      int ii = j-mm*(this_phi_n-1);
+      phi_c[kc_phi+j] = v1[q[2]+mm*(q[0]-1)+phi_first+ii];
+    }
+    for (int j=lid; j<a_size; j+=lsize) {
+      int mm = j/(this_a_n-1);
+      int ii = j-mm*(this_a_n-1);
+      a_c[kc_a+j] = v3[q[4]+mm*(q[1]-1)+a_first+ii];
+    }
+    k_phi += this_phi_n;
+    k_a += this_a_n;
+    kc_phi += phi_size;
+    kc_a += a_size;
+  }
+  barrier(CLK_LOCAL_MEM_FENCE);
+  if (staging_err) {ERR(err,i,staging_err); return;}
+  int j1 = i*samples_per_instance;
+  int j2 = (i+1)*samples_per_instance-1;
+  if (j1>=n_samples) {return;} // an instance that we didn't need
+  if (j2>=n_samples) {j2=n_samples-1;}
+  // output offset and accumulate flag work the same way as in fn_osc
+  oscillator_cubic_spline(y+i_pars[3],i_pars[4],err,error_details,i,
+                          phi_c,phi_knots,phi_n,
+                          a_c,  a_knots,  a_n,
+                          OSC_MODE_GENERAL,0,0, // no multipliers in this mode, and all partials are active
+                          0,i_pars[6], // the windows are short, so the knot cursors can start at the beginning
+                          f_pars[0],f_pars[1],j1,j2,n_partials
+                         );
+}
+
+/*
+  Same computation as fn_osc, with the same inputs, but with the work items laid out in two dimensions, so that there can be
+  more of them than there are time blocks. This is for short notes with many partials, where fn_osc would leave most of the
+  device idle. Along dimension 0, each workgroup has lsize work items, which between them do a tile of
+  lsize*samples_per_instance consecutive samples, interleaved so that neighboring work items do neighboring samples and
+  their writes to y are coalesced. Along dimension 1 are n_lanes lanes (a power of 2), and lane p does partials p, p+n_lanes,
+  p+2*n_lanes, ...; the lanes' sums are then added up in local memory. The spline data are read from global memory, and
+  active has one mask per workgroup rather than per instance; see OscillatorLowLevel.run().
+  In OSC_MODE_RECURRENCE, the recurrence can't be used, since consecutive harmonics are in different lanes, so we do the
+  same thing as for OSC_MODE_HARMONIC.
+  i = global id along dimension 0, which is what errors are reported under; group = group id along dimension 0,
+  lid = local id along dimension 0, lsize = local size along dimension 0, lane = local id along dimension 1
+  Every work item has to reach every barrier, so errors don't cause a return, only cause the work item to stop computing.
+*/
+void fn_osc_2d(__global FLOAT *y,int i,int group,int lid,int lsize,int lane,int n_lanes,
+                         __global int *err, __global int *error_details,
+                         __global const FLOAT *v1, __global const FLOAT *v2, __global const FLOAT *v3, __global const FLOAT *v4,
+                         __global const int *k1,  __global const int *k2, __global const FLOAT *mult,
+                         __global const uint *active,
+                         __global const long *i_pars, __global const FLOAT *f_pars,
+                         __local int *offsets, __local FLOAT *sums) {
+  int samples_per_instance = i_pars[0];
+  int n_partials = i_pars[1];
+  int n_samples = i_pars[2];
+  int mode = i_pars[5];
+  FLOAT t0 = f_pars[0];
+  FLOAT dt = f_pars[1];
+  // These checks give the same result for every work item. As in fn_osc, errors are only reported after the barrier, and
+  // don't cause a return.
+  int staging_err = 0;
+  DEBUG(if (!(samples_per_instance>0 && n_partials>0)) {staging_err = HONK_ERR_ILLEGAL_VALUE;}) // sanity check
+  if (n_partials>MAX_PARTIALS) {staging_err = HONK_ERR_TOO_MANY_PARTIALS;}
+  if (lsize*n_lanes>MAX_LOCAL_2D) {staging_err = HONK_ERR_INDEX_OUT_OF_RANGE;}
+  // offsets[4*m+...] = where partial m's data start in v1...v4
+  if (lid==0 && lane==0 && !staging_err) {
+    int kc_phi = 0;
+    int k_phi = 0;
+    int kc_a = 0;
+    int k_a = 0;
+    for (int m=0; m<n_partials; m++) {
+      offsets[4*m] = kc_phi;
+      offsets[4*m+1] = k_phi;
+      offsets[4*m+2] = kc_a;
+      offsets[4*m+3] = k_a;
+      if (mode==OSC_MODE_GENERAL) { // in the harmonic modes, all partials use partial 0's phase spline
+        kc_phi += (k1[m]-1)*(PHASE_SPLINE_ORDER+1);
+        k_phi += k1[m];
+      }
+      kc_a += (k2[m]-1)*(A_SPLINE_ORDER+1);
+      k_a += k2[m];
+    }
+  }
+  barrier(CLK_LOCAL_MEM_FENCE);
+  if (staging_err) {ERR(err,i,staging_err);} // and skip the loop below, which every work item then does
+  __global const uint *group_active = active+ACTIVE_MASK_WORDS*group;
+  __global FLOAT *y_out = y+i_pars[3]; // output offset and accumulate flag work the same way as in fn_osc
+  int accumulate = i_pars[4];
+  FLOAT acc[BLOCK_SIZE];
+  FLOAT phi_private[BLOCK_SIZE];
+  int failed = 0;
+  // Do the tile in chunks of BLOCK_SIZE*lsize samples; in a chunk, this work item does every lsize-th sample.
+  int tile = group*lsize*samples_per_instance;
+  for (int c=0; c<samples_per_instance && !staging_err; c+=BLOCK_SIZE) {
+    int n_s = samples_per_instance-c;
+    if (n_s>BLOCK_SIZE) {n_s=BLOCK_SIZE;}
+    int first = tile+c*lsize+lid; // index of our first sample in this chunk
+    int n_mine = 0; // number of our samples in this chunk that are within the output
+    while (n_mine<n_s && first+n_mine*lsize<n_samples) {n_mine++;}
+    for (int s=0; s<n_s; s++) {
+      acc[s] = 0.0;
+    }
+    if (mode!=OSC_MODE_GENERAL && n_mine>0 && !failed) {
+      int phi_i = find_knot_global(v2,k1[0],t0+dt*first);
+      for (int s=0; s<n_mine; s++) {
+        int local_err;
+        phi_private[s] = spline_global(v1,v2,k1[0],PHASE_SPLINE_ORDER,&phi_i,t0+dt*(first+s*lsize),&local_err);
+        if (local_err) {ERR(err,i,local_err); failed=1; break;}
+      }
+    }
+    for (int m=lane; m<n_partials && n_mine>0 && !failed; m+=n_lanes) {
+      if (!IS_ACTIVE(group_active,m)) {continue;}
+      __global const FLOAT *phi_c = v1+offsets[4*m];
+      __global const FLOAT *phi_knots = v2+offsets[4*m+1];
+      __global const FLOAT *a_c = v3+offsets[4*m+2];
+      __global const FLOAT *a_knots = v4+offsets[4*m+3];
+      int phi_n = k1[m];
+      int a_n = k2[m];
+      FLOAT this_mult = mult[m];
+      int phi_i = 0;
+      if (mode==OSC_MODE_GENERAL) {phi_i = find_knot_global(phi_knots,phi_n,t0+dt*first);}
+      int a_i = find_knot_global(a_knots,a_n,t0+dt*first);
+      for (int s=0; s<n_mine; s++) {
+        FLOAT t = t0+dt*(first+s*lsize);
+        int local_err;
+        FLOAT phi;
+        if (mode==OSC_MODE_GENERAL) {
+          phi = spline_global(phi_c,phi_knots,phi_n,PHASE_SPLINE_ORDER,&phi_i,t,&local_err);
+          if (local_err) {ERR(err,i,local_err); failed=1; break;}
+        }
+        else {
+          phi = this_mult*phi_private[s];
+        }
+        FLOAT a = spline_global(a_c,a_knots,a_n,A_SPLINE_ORDER,&a_i,t,&local_err);
+        if (local_err) {ERR(err,i,local_err); failed=1; break;}
+        acc[s] += a*sin(phi);
+      }
+    }
+    // Add up the lanes, one sample at a time, by a tree reduction in local memory, and then lane 0 writes out the result.
+    for (int s=0; s<n_s; s++) {
+      sums[lane*lsize+lid] = acc[s];
+      barrier(CLK_LOCAL_MEM_FENCE);
+      for (int stride=n_lanes/2; stride>0; stride/=2) {
+        if (lane<stride) {sums[lane*lsize+lid] += sums[(lane+stride)*lsize+lid];}
+        barrier(CLK_LOCAL_MEM_FENCE);
+      }
+      if (lane==0 && s<n_mine) {
+        int j = first+s*lsize;
+        if (accumulate) {y_out[j] += sums[lid];} else {y_out[j] = sums[lid];}
+      }
+    }
+  }
 }
 
 /*
@@ -207,16 +763,54 @@ FLOAT spline(__local FLOAT *c,__local FLOAT *knots,int n,int k,int *i,FLOAT x,in
   return s;
 }
 
+/*
+  Same as spline(), but for data in global memory.
+*/
+FLOAT spline_global(__global const FLOAT *c,__global const FLOAT *knots,int n,int k,int *i,FLOAT x,int *local_err) {
+  DEBUG(if (*i<0 || *i>=n-1) {*local_err = HONK_ERR_INDEX_OUT_OF_RANGE; return NAN;})
+  while (*i<=n-3 && x>knots[*i+1]) {(*i)++;}
+  FLOAT d = x-knots[*i];
+  DEBUG(if (isnan(knots[*i])) {*local_err = HONK_ERR_NAN; return NAN;})
+  if (d<0) {*local_err= HONK_ERR_ILLEGAL_VALUE; return 0.0;}
+  FLOAT p = 1.0;
+  int j = (n-1)*k+*i;
+  FLOAT s = 0.0;
+  for (int m=k; ; m--) {
+    s = s + c[j]*p;
+    if (m==0) {break;}
+    p = p*d;
+    j -= (n-1);
+  }
+  *local_err = 0;
+  return s;
+}
+
+/*
+  Binary search for the initial guess to pass to spline_global(). Gives the same result as the linear search in spline(), i.e.,
+  the first i such that x<=knots[i+1], or n-2 if there is no such i. This saves us from scanning the whole spline
+  from its beginning when we start in the middle of a long note.
+*/
+int find_knot_global(__global const FLOAT *knots,int n,FLOAT x) {
+  int lo = 0;
+  int hi = n-2;
+  while (lo<hi) {
+    int mid = (lo+hi)/2;
+    if (x>knots[mid+1]) {lo=mid+1;} else {hi=mid;}
+  }
+  return lo;
+}
+
 void set_flags(__global int *error_array,int instance,int f1,int f2,int f3) {
-  int k=instance*64;
+  int k=instance*ERROR_DETAILS_SIZE;
   error_array[k] = f1;
   error_array[k+1] = f2;
   error_array[k+2] = f3;
 }
 
-// See oscillator.py for info about how errors are handled.
+// See ErrorChannel in oscillator.py for info about how errors are handled.
 void flag_err(__global int *error_array,int instance,int err,int where_in_code) {
-  error_array[instance] = err*1000+where_in_code;
+  error_array[0] = 1; // any instance that has an error sets this flag, which is the only thing the host reads if all is well
+  error_array[instance+1] = err*1000+where_in_code;
 }
 
 // benchmark using the Riemann zeta function
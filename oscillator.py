@@ -1,172 +1,318 @@
-import numpy,functools,scipy,math,ctypes,sys,functools,copy
+import numpy,functools,scipy,math,sys,functools,copy
 from scipy import interpolate
-import pyopencl as cl
+try:
+  import pyopencl as cl
+except ImportError:
+  cl = None # can still run on a NumpyDevice
 
 
+import constants
+from partial import HarmonicStack
+
+ERROR_DETAILS_SIZE = constants.defaults['ERROR_DETAILS_SIZE']
+A_SPLINE_ORDER = constants.defaults['A_SPLINE_ORDER']
+PHASE_SPLINE_ORDER = constants.defaults['PHASE_SPLINE_ORDER']
+WINDOW_I_SIZE = constants.defaults['WINDOW_I_SIZE']
+OSC_MODE_GENERAL = constants.defaults['OSC_MODE_GENERAL']
+OSC_MODE_HARMONIC = constants.defaults['OSC_MODE_HARMONIC']
+OSC_MODE_RECURRENCE = constants.defaults['OSC_MODE_RECURRENCE']
+MAX_LOCAL_2D = constants.defaults['MAX_LOCAL_2D']
+
 class Oscillator:
   """
   A list of OscillatorSeq objects that are simultaneous and need to be added at the end.
   """
-  cpu_c_lib = ctypes.cdll.LoadLibrary('./cpu_c.so')
-  MAX_SPLINE_KNOTS,SPLINE_ORDER,MAX_SPLINE_COEFFS,MAX_PARTIALS,MAX_INSTANCES = (
-               cpu_c_lib.get_max_sizes(0),cpu_c_lib.get_max_sizes(1),cpu_c_lib.get_max_sizes(2),cpu_c_lib.get_max_sizes(3),cpu_c_lib.get_max_sizes(4))
-  def __init__(self,pars,partials):
-    # pars should contain keys n_samples, n_instances, t0, and dt
-    maxp = Oscillator.MAX_PARTIALS
+  def __init__(self,pars,partials,dev):
+    # pars should contain keys n_samples, t0, and dt, and optionally n_instances, which otherwise comes from dev.launch_config()
+    # If pars['windowed'] is true, long notes are done with the oscillator_windowed kernel rather than being split up in time,
+    # except when the knots are too dense for the number of workgroups; see OscillatorWindowed and OscillatorSeq.setup_windowed().
+    # For a HarmonicStack whose multipliers are 1, 2, 3, ..., or any other increasing sequence of integers, the kernel gets
+    # sin(n*phi) from a recurrence rather than calling sin() for every partial, unless pars['recurrence'] is false.
+    # Partials are skipped for any instance in which they're above the Nyquist frequency or their amplitude is below
+    # pars['amplitude_floor'] (default 1.0e-6) throughout; pars['cull']=False turns this off. See active_partials().
+    # If pars['lanes'] is given, the oscillator_2d kernel is used, with that many lanes of work items in each workgroup sharing
+    # the partials; the idea is to keep more of a GPU busy when there are many partials and few samples. See fn_osc_2d(). This
+    # is off by default, because on a CPU OpenCL device (pocl) it's about 4 times slower than the ordinary kernel for the
+    # violin tone in honk.py, since it reads the splines from global memory and can't use the recurrence.
+    # The kernels evaluate splines by forward differences, unless pars['forward_differences'] is false; see spline_block().
+    # dev is the device we're going to run on; we need to know its limits on the amount of data in one launch
+    # partials can be a list of Partial objects or a HarmonicStack
+    self.limits = dev.limits
+    if not ('n_instances' in pars):
+      pars = copy.deepcopy(pars)
+      pars['n_instances'] = dev.launch_config()['n_instances']
+    # Nothing is planned or set up until run() is called, so that if we only use stream(), the data for the whole note
+    # never exist at once.
+    self.pars,self.partials = (pars,partials)
+    self.oseqs = None # built by setup()
+    self.n_samples = pars['n_samples']
+    self.errors = None
+    self.out = None
+
+  def setup(self):
+    # Split the partials into sets that are small enough for one launch, and make an OscillatorSeq for each. Done only once.
+    if self.oseqs is not None:
+      return
+    partials = self.partials
+    maxp = self.limits['MAX_PARTIALS']
     n_sets = int(len(partials)/maxp)
     if n_sets*maxp<len(partials):
       n_sets += 1
     self.oseqs = []
     for j in range(n_sets):
-      this_set = []
       k1 = j*maxp
       k2 = (j+1)*maxp-1
       if k2>len(partials)-1:
         k2=len(partials)-1
-      for k in range(k1,k2+1): # range doesn't include upper arg, so add 1
-        this_set.append(partials[k])
-      self.oseqs.append(OscillatorSeq(pars,this_set))
+      if isinstance(partials,HarmonicStack):
+        this_set = partials.subset(k1,k2+1) # each set still has just a single phase spline
+      else:
+        this_set = partials[k1:k2+1]
+      self.oseqs.append(OscillatorSeq(self.pars,this_set,self.limits))
 
   def error_code(self):
-    for o in self.oseqs:
-      if o.error_code()!=0:
-        return o.error_code()
-    return 0
-
-  def run(self,dev,local_size):
-    for o in self.oseqs:
-      o.run(dev,local_size)
-
-  def y(self): # results of synthesis
-    yy = None
-    first_one = True
-    for o in self.oseqs:
-      this_y = o.y()
-      if first_one:
-        yy = this_y
-        first_one = False
-      else:
-        yy = numpy.add(yy,this_y)
-    return yy
+    if self.errors is None:
+      return 0
+    return self.errors.code
+
+  def run(self,dev,local_size=None,out=None):
+    # Everything is enqueued without blocking, and we only wait once, at the end.
+    # If local_size isn't given, it comes from dev.launch_config(), which has the autotuned value if there is one.
+    # out is an optional array to render into, which is what y() will then return; see output_array(). For a render that's too
+    # long to fit in memory, use output_file() to make one that's backed by a file on disk.
+    self.start(dev,local_size,out)
+    self.wait(dev)
+
+  def start(self,dev,local_size=None,out=None,buffers=''):
+    """
+    The part of run() that enqueues the work, without waiting for it; follow it with wait(). buffers is a suffix for the names
+    of the pooled device buffers used for the output and the errors, so that another render with a different suffix can
+    be in flight at the same time.
+    """
+    check_limits(self.limits,dev)
+    if local_size is None:
+      local_size = dev.launch_config()['local_size']
+    self.setup()
+    self.errors = ErrorChannel(max(map(lambda o:o.n_instances,self.oseqs)),buffers)
+    events = self.errors.clear(dev)
+    # All the partial sets and time segments go into one output buffer on the device, which we read back once at the end.
+    # The first set of partials writes to it, and the others add to what's there.
+    self.out = output_array(out,self.n_samples)
+    y = output_buffer(dev,self.out,'y'+buffers)
+    for k in range(len(self.oseqs)):
+      events = self.oseqs[k].enqueue(dev,local_size,self.errors,y,k>0,events)
+    self.done = read_output(dev,self.out,y,self.oseqs[0].slices(),events)+self.errors.read_flag(dev,events)
+
+  def wait(self,dev):
+    # Wait for the work enqueued by start(), but not for anything enqueued after it, and check for errors.
+    wait_for_events(dev,self.done)
+    flush_output(self.out)
+    self.errors.check(dev)
+
+  def y(self): # results of synthesis, a float32 array of length n_samples, not a copy
+    return self.out
+
+  def stream(self,dev,window=1<<18,local_size=None):
+    """
+    A generator that renders the output in time order, window samples at a time, and yields each window's samples, as a
+    float32 array, as soon as they're done. Each window is set up using just the part of each partial that it overlaps,
+    so memory use depends on the size of the window rather than the length of the output. One window ahead is set up and
+    enqueued before we wait for the current one, so on an OpenClDevice, the device is rendering the next window while the
+    caller is writing out this one. If there's an error, we stop early; after the loop, check error_code(), as with run().
+    This doesn't use or create the setup that run() does, so the usual way to do it is Oscillator(pars,partials,dev).stream(dev).
+    """
+    return stream_windows(lambda w_pars,w_partials:Oscillator(w_pars,w_partials,dev),self,self.pars,self.partials,
+                          dev,window,local_size)
 
 class OscillatorSeq:
   """
   A list of OscillatorLowLevel objects that occur sequentially in time.
   """
-  cpu_c_lib = ctypes.cdll.LoadLibrary('./cpu_c.so')
-  MAX_SPLINE_KNOTS,SPLINE_ORDER,MAX_SPLINE_COEFFS,MAX_PARTIALS,MAX_INSTANCES = (
-               cpu_c_lib.get_max_sizes(0),cpu_c_lib.get_max_sizes(1),cpu_c_lib.get_max_sizes(2),cpu_c_lib.get_max_sizes(3),cpu_c_lib.get_max_sizes(4))
-  def __init__(self,pars,partials):
+  def __init__(self,pars,partials,limits):
     # pars should contain keys n_samples, n_instances, t0, and dt
+    # partials is a list of Partial objects or a HarmonicStack
+    # limits is a dict such as the one returned by constants.limits()
+    # As with Oscillator, the segments are only set up when they're first needed, and stream() doesn't need them at all.
+    self.limits = limits
+    self.pars,self.partials = (pars,partials)
     self.n_samples,self.t0,self.dt,self.n_instances = (
           pars['n_samples'],pars['t0'],pars['dt'],pars['n_instances'])
-    if self.too_big_horizontally(partials):
-      n_samples,t0,dt = (pars['n_samples'],pars['t0'],pars['dt'])
-      if n_samples==0:
-        raise Exception("recursion failed to bottom out")
-      nn = [0,0]
-      nn[0] = int(n_samples/2)
-      nn[1] = n_samples-nn[0]
-      subs = []
-      for i in range(2):
-        sub_pars = copy.deepcopy(pars)
-        sub_pars['n_samples'] = nn[i]
-        if i==0:
-          sub_t0 = t0
-        else:
-          sub_t0 = t0+nn[0]*dt
-        sub_t1 = sub_t0+(nn[i]-1)*dt
-        sub_pars['t0'] = sub_t0
-        sub_partials = []
-        for p in partials:
-          sub_partials.append(p.restrict(sub_t0,sub_t1))
-        subs.append(OscillatorSeq(sub_pars,sub_partials))
-      self.os = subs[0].os
-      self.cat(subs[1])
+    self.errors = None
+    self.out = None
+    self.os = None # built by setup()
+    if pars.get('windowed',False) and isinstance(partials,HarmonicStack):
+      raise Exception("windowed mode doesn't support HarmonicStack; use HarmonicStack.partials()")
+
+  def setup(self,local_size):
+    # local_size is needed in windowed mode, where it determines how many knots each workgroup needs.
+    if self.os is not None:
       return
-    # If we get to here, we didn't need to recurse.
-    n_samples = pars['n_samples']
+    pars,partials,limits = (self.pars,self.partials,self.limits)
     n_instances = pars['n_instances']
-    samples_per_instance = int(n_samples/n_instances)
-    if samples_per_instance*n_instances<n_samples:
-      samples_per_instance += 1
-    pars2 = copy.deepcopy(pars)
-    pars2['samples_per_instance'] = samples_per_instance
-    self.os = [OscillatorLowLevel(self,pars2)]
-    for o in self.os:
-      o.setup(partials)
+    if pars.get('windowed',False):
+      self.setup_windowed(n_instances,local_size)
+      return
+    # Cut the time range into segments that are each small enough to fit in one launch, and restrict the partials to each one.
+    # Each segment's partials are shifted in time so that it starts at t=0, since the kernel's times are only float32.
+    self.os = []
+    for (j,n) in plan_segments(partials,self.n_samples,self.t0,self.dt,limits):
+      sub_pars = copy.deepcopy(pars)
+      sub_pars['n_samples'],sub_pars['t0'],sub_pars['offset'] = (n,0.0,pars.get('offset',0)+j)
+      sub_pars['samples_per_instance'] = samples_per_instance_for(n,n_instances)
+      sub_t1 = self.t0+j*self.dt
+      sub_t2 = self.t0+(j+n-1)*self.dt # computed the same way as in plan_segments()
+      o = OscillatorLowLevel(self,sub_pars)
+      o.setup(time_shift(restrict(partials,sub_t1,sub_t2),sub_t1))
+      self.os.append(o)
 
-  def cat(self,osc):
-    # concatenate two oscillators; doesn't return anything
-    self.os.extend(osc.os)
+  def setup_windowed(self,n_instances,local_size):
+    """
+    The kernel only stages the part of each spline that each workgroup needs, so usually the whole note can be done in one
+    launch. But if the knots are dense compared to the number of workgroups, a workgroup can need more than MAX_SPLINE_KNOTS,
+    and then we cut the note into k segments of equal length, each done by its own launch, using the smallest k that works.
+    """
+    k = 1
+    while True:
+      self.os = []
+      for i in range(k):
+        j = (i*self.n_samples)//k
+        n = ((i+1)*self.n_samples)//k-j
+        sub_pars = copy.deepcopy(self.pars)
+        sub_pars['n_samples'],sub_pars['t0'],sub_pars['offset'] = (n,0.0,self.pars.get('offset',0)+j)
+        sub_pars['samples_per_instance'] = samples_per_instance_for(n,n_instances)
+        sub_t1 = self.t0+j*self.dt
+        o = OscillatorWindowed(self,sub_pars)
+        if k==1:
+          o.setup(time_shift(self.partials,sub_t1))
+        else:
+          o.setup(time_shift(restrict(self.partials,sub_t1,self.t0+(j+n-1)*self.dt),sub_t1))
+        self.os.append(o)
+      overflow = max(map(lambda o:o.overflow(n_instances,local_size),self.os))
+      if overflow<=1.0:
+        return
+      if k>=self.n_samples:
+        raise Exception(f"can't fit the partials into the limits on knots even with one sample per segment; limits={self.limits}")
+      # The knots needed by a workgroup are roughly proportional to the length of time it covers.
+      k = min(max(k+1,int(math.ceil(k*overflow))),self.n_samples)
 
   def error_code(self):
-    for o in self.os:
-      if o.error_code()!=0:
-        return o.error_code()
-    return 0
+    if self.errors is None:
+      return 0
+    return self.errors.code
 
   def __str__(self):
     s = 'Oscillator:\n'
+    if self.os is None:
+      return s+'not set up yet\n'
     for o in self.os:
       s = s + str(o)
     return s
 
-  def run(self,dev,local_size):
-    for o in self.os:
-      o.run(dev,o.n_instances,local_size)
+  def run(self,dev,local_size=None,out=None):
+    self.start(dev,local_size,out)
+    self.wait(dev)
+
+  def start(self,dev,local_size=None,out=None,buffers=''):
+    # Same as Oscillator.start().
+    check_limits(self.limits,dev)
+    if local_size is None:
+      local_size = dev.launch_config()['local_size']
+    self.errors = ErrorChannel(self.n_instances,buffers)
+    self.out = output_array(out,self.n_samples)
+    y = output_buffer(dev,self.out,'y'+buffers)
+    events = self.enqueue(dev,local_size,self.errors,y,False,self.errors.clear(dev))
+    self.done = read_output(dev,self.out,y,self.slices(),events)+self.errors.read_flag(dev,events)
 
-  def y(self): # results of synthesis
-    yy = []
+  def wait(self,dev):
+    # Same as Oscillator.wait().
+    wait_for_events(dev,self.done)
+    flush_output(self.out)
+    self.errors.check(dev)
+
+  def slices(self):
+    # A list of (offset,n_samples) for each segment, which between them cover our output. Only available after enqueue().
+    return list(map(lambda o:(o.offset,o.n_samples),self.os))
+
+  def enqueue(self,dev,local_size,errors,y,accumulate,wait_for=None):
+    """
+    Enqueue all the segments, each waiting for the one before; returns the events of the last one.
+    Each segment writes its samples into y at its own offset, or adds them to what's already there if accumulate is true.
+    """
+    self.setup(local_size)
+    events = wait_for
     for o in self.os:
-      yy.extend(o.y)
-    return yy
-
-  def too_big_horizontally(self,partials):
-    n_phi_knots = self.count_knots(partials,"phi")
-    n_a_knots = self.count_knots(partials,"a")
-    if False:
-      print("artificially causing a horizontal split")
-      return (n_phi_knots>200 or n_a_knots>200)
-    return (n_phi_knots>Oscillator.MAX_SPLINE_KNOTS or n_a_knots>Oscillator.MAX_SPLINE_KNOTS)
-
-  def count_knots(self,partials,which):
-    if which=="phi":
-      l = lambda p:p.phi.x
-    else:
-      l = lambda p:p.a.x
-    return len(functools.reduce(cat,list(map(l,partials))))
+      events = o.run(dev,o.n_instances,local_size,errors,y,accumulate,events)
+    return events
+
+  def y(self): # results of synthesis, a float32 array of length n_samples, not a copy
+    return self.out
+
+  def stream(self,dev,window=1<<18,local_size=None):
+    # Same as Oscillator.stream(), for a set of partials that doesn't need to be split up because of MAX_PARTIALS.
+    return stream_windows(lambda w_pars,w_partials:OscillatorSeq(w_pars,w_partials,self.limits),self,self.pars,self.partials,
+                          dev,window,local_size)
+
+def stream_windows(make,owner,pars,partials,dev,window,local_size):
+  """
+  The generator behind Oscillator.stream() and OscillatorSeq.stream(). For each window, make(w_pars,w_partials) returns
+  an Oscillator or OscillatorSeq for just that window, which is run and then thrown away. Errors are reported by setting
+  owner.errors. Two windows are in flight at a time, alternating between two sets of pooled buffers, and we only wait for
+  the older one. Each window's partials are shifted in time so that its first sample is at t=0; the kernels get their
+  times in float32, and a window starting at, e.g., t=100 s would otherwise be off by up to 4 microseconds, which for a
+  partial at 5 kHz is a phase error of about 0.1 radians.
+  """
+  n_samples,t0,dt = (pars['n_samples'],pars['t0'],pars['dt'])
+  previous = None
+  for j in list(range(0,n_samples,window))+[None]:
+    w = None
+    if j is not None:
+      n = min(window,n_samples-j)
+      w_pars = copy.deepcopy(pars)
+      w_pars['n_samples'],w_pars['t0'] = (n,0.0)
+      w_pars.pop('offset',None) # each window's output is an array of its own
+      t1 = t0+j*dt
+      t2 = t1+(n-1)*dt
+      w = make(w_pars,time_shift(restrict(partials,t1,t2),t1))
+      w.start(dev,local_size,buffers=str((j//window)%2))
+    if previous is not None:
+      previous.wait(dev)
+      owner.errors = previous.errors
+      if previous.error_code()!=0:
+        dev.finish() # don't leave the next window running on the device
+        return
+      yield previous.y()
+    previous = w
 
 class OscillatorLowLevel:
   def __init__(self,parent,pars):
-    # pars should contain keys n_samples, samples_per_instance, n_instances, t0, and dt
+    # pars should contain keys n_samples, samples_per_instance, n_instances, t0, and dt, and optionally offset
+    # offset is the index in the output buffer at which our first sample goes
     self.parent = parent
     self.n_samples,self.samples_per_instance,self.t0,self.dt,self.n_instances = (
           pars['n_samples'],pars['samples_per_instance'],pars['t0'],pars['dt'],pars['n_instances'])
-    # buffer to hold synthesized sound:
-    self.y = numpy.zeros(self.n_samples, numpy.float32)
+    self.offset = pars.get('offset',0)
+    self.recurrence = pars.get('recurrence',True)
+    self.cull = pars.get('cull',True)
+    self.amplitude_floor = pars.get('amplitude_floor',1.0e-6)
+    self.lanes = pars.get('lanes',None)
+    self.incremental = pars.get('forward_differences',True)
     # misc data structures:
     self.clear_small_arrays()
-    self.my_errors = 0
-
-  def error_code(self):
-    return self.err[0]
 
   def clear(self):
-    self.y.fill(0.0)
     self.clear_small_arrays()
 
   def clear_small_arrays(self):
-    self.err = numpy.zeros(Oscillator.MAX_INSTANCES, numpy.int32)
-    self.error_details = numpy.zeros(Oscillator.MAX_INSTANCES*64, numpy.int32)
     self.info = numpy.zeros(100, numpy.float32)
     self.n_info = numpy.zeros(1, numpy.int32)
-    self.phi_c = numpy.zeros(Oscillator.MAX_SPLINE_COEFFS, numpy.float32)
-    self.phi_knots = numpy.zeros(Oscillator.MAX_SPLINE_KNOTS, numpy.float32)
-    self.a_c = numpy.zeros(Oscillator.MAX_SPLINE_COEFFS, numpy.float32)
-    self.a_knots = numpy.zeros(Oscillator.MAX_SPLINE_KNOTS, numpy.float32)
-    self.phi_n = numpy.zeros(Oscillator.MAX_PARTIALS, numpy.int32)
-    self.a_n = numpy.zeros(Oscillator.MAX_PARTIALS, numpy.int32)
+    limits = self.parent.limits
+    self.phi_c = numpy.zeros(limits['MAX_SPLINE_COEFFS'], numpy.float32)
+    self.phi_knots = numpy.zeros(limits['MAX_SPLINE_KNOTS'], numpy.float32)
+    self.a_c = numpy.zeros(limits['MAX_SPLINE_COEFFS'], numpy.float32)
+    self.a_knots = numpy.zeros(limits['MAX_SPLINE_KNOTS'], numpy.float32)
+    self.phi_n = numpy.zeros(limits['MAX_PARTIALS'], numpy.int32)
+    self.a_n = numpy.zeros(limits['MAX_PARTIALS'], numpy.int32)
+    self.mult = numpy.ones(limits['MAX_PARTIALS'], numpy.float32) # multipliers for a HarmonicStack
     self.i_pars = numpy.zeros(100, numpy.int64)
     self.f_pars = numpy.zeros(100, numpy.float32)
 
@@ -174,15 +320,29 @@ class OscillatorLowLevel:
     self.clear()
     self.partials = partials
     # create flattened versions of input data for consumption by opencl
-    two_pi = 2.0*math.pi
-    copy_into_numpy_array(self.phi_knots,     functools.reduce(cat,list(map(lambda p:p.phi.x,partials))) )
-    copy_into_numpy_array(self.a_knots,       functools.reduce(cat,list(map(lambda p:p.a.x,    partials))) )
-    copy_into_numpy_array(self.phi_c,         functools.reduce(cat,list(map(lambda p:p.phi.c.flatten(),partials))) )
-    copy_into_numpy_array(self.a_c,           functools.reduce(cat,list(map(lambda p:p.a.c.flatten(),    partials))) )
-    for i in range(len(partials)):
-      p = partials[i]
-      self.phi_n[i] = len(p.phi.x)
-      self.a_n[i] = len(p.a.x)
+    phis,amps = splines(partials)
+    copy_into_numpy_array(self.phi_knots,     functools.reduce(cat,list(map(lambda s:s.x,phis))) )
+    copy_into_numpy_array(self.a_knots,       functools.reduce(cat,list(map(lambda s:s.x,amps))) )
+    copy_into_numpy_array(self.phi_c,         functools.reduce(cat,list(map(lambda s:s.c.flatten(),phis))) )
+    copy_into_numpy_array(self.a_c,           functools.reduce(cat,list(map(lambda s:s.c.flatten(),amps))) )
+    for i in range(len(phis)):
+      self.phi_n[i] = len(phis[i].x)
+    for i in range(len(amps)):
+      self.a_n[i] = len(amps[i].x)
+    if isinstance(partials,HarmonicStack):
+      self.mult[0:len(partials)] = partials.multipliers
+      if self.recurrence and partials.integer_multipliers():
+        self.i_pars[5] = OSC_MODE_RECURRENCE
+      else:
+        self.i_pars[5] = OSC_MODE_HARMONIC
+    else:
+      self.i_pars[5] = OSC_MODE_GENERAL
+    if self.cull:
+      self.active = active_partials(partials,self.n_instances,self.samples_per_instance,self.t0,self.dt,self.amplitude_floor,
+                                    self.parent.limits['ACTIVE_MASK_WORDS'])
+    else:
+      self.active = numpy.full(self.n_instances*self.parent.limits['ACTIVE_MASK_WORDS'],0xffffffff,numpy.uint32)
+    self.cursors = knot_cursors(partials,self.n_instances,self.samples_per_instance,self.t0,self.dt)
     t1 = self.t0+self.dt*self.n_samples
     if not (self.in_time_range(self.t0) and self.in_time_range(t1)):
       raise Exception(f"illegal time range, t={self.t0} to {t1} is not within time range of partials, which is {self.defined_time_range()}")
@@ -191,9 +351,13 @@ class OscillatorLowLevel:
     self.i_pars[0] = self.samples_per_instance
     self.i_pars[1] = len(partials)
     self.i_pars[2] = self.n_samples
+    self.i_pars[3] = self.offset
+    self.i_pars[6] = int(self.incremental)
 
   def defined_time_range(self):
     # intersection of domains of all partials
+    if isinstance(self.partials,HarmonicStack):
+      return self.partials.time_range()
     a,b = self.partials[0].time_range()
     for p in self.partials:
       (aa,bb) = p.time_range()
@@ -214,63 +378,561 @@ class OscillatorLowLevel:
     result = result + "phi_c = "+sa(self.phi_c)+"\n"
     return result
 
-  def run(self,dev,n_instances,local_size):
+  def run(self,dev,n_instances,local_size,errors,y,accumulate,wait_for=None):
+    """
+    Our samples go into y starting at index self.offset, or are added to what's already there if accumulate is true.
+    On an OpenClDevice, y is a device buffer (see output_buffer()), and this only enqueues the work, using buffers from the
+    device's pool, and returns without waiting for the results. The return value is a list of events that will be complete
+    once the kernel has finished writing to y. wait_for is a list of events that have to complete before we can start, typically the ones returned by the
+    previous segment, since it uses the same pooled buffers. Errors are reported through errors, an ErrorChannel that is
+    shared by all the segments; the caller should do dev.finish() and then errors.check().
+    """
     if n_instances%local_size!=0:
       raise Exception(f"local_size={local_size} is not a divisor of n_instances={n_instances}")
-    if n_instances>self.parent.MAX_INSTANCES:
-      raise Exception(f"n_instances={n_instances} is greater than {self.parent.MAX_INSTANCES}")
+    if n_instances>self.parent.limits['MAX_INSTANCES']:
+      raise Exception(f"n_instances={n_instances} is greater than {self.parent.limits['MAX_INSTANCES']}")
+    self.i_pars[4] = int(accumulate)
+    if dev.backend=='numpy':
+      self.run_numpy(dev,errors,y)
+      return []
 
-    mem_flags = cl.mem_flags
-    context = dev.context
-    program = dev.program
     queue = dev.queue
 
-    y_buf = cl.Buffer(context, mem_flags.WRITE_ONLY, self.y.nbytes) # This doesn't initialize it to 0, because write only.
-    err_buf = cl.Buffer(context, mem_flags.WRITE_ONLY | mem_flags.COPY_HOST_PTR, hostbuf=self.err)
-    # Each instance gets its own 32-bit ints for error reporting. These are write-only, which limits what the kernel can do.
-    # Each kernel starts by writing 0 to its flag. If there's an error, it overwrites that with a code that packs some error info in it.
-    error_details_buf  = cl.Buffer(context, mem_flags.WRITE_ONLY | mem_flags.COPY_HOST_PTR, hostbuf=self.error_details)
-    info_buf = cl.Buffer(context, mem_flags.READ_ONLY | mem_flags.COPY_HOST_PTR, hostbuf=self.info)
-    n_info_buf = cl.Buffer(context, mem_flags.READ_ONLY | mem_flags.COPY_HOST_PTR, hostbuf=self.n_info)
-    phi_c_buf = cl.Buffer(context, mem_flags.READ_ONLY | mem_flags.COPY_HOST_PTR, hostbuf=self.phi_c)
-    phi_knots_buf = cl.Buffer(context, mem_flags.READ_ONLY | mem_flags.COPY_HOST_PTR, hostbuf=self.phi_knots)
-    a_c_buf = cl.Buffer(context, mem_flags.READ_ONLY | mem_flags.COPY_HOST_PTR, hostbuf=self.a_c)
-    a_knots_buf = cl.Buffer(context, mem_flags.READ_ONLY | mem_flags.COPY_HOST_PTR, hostbuf=self.a_knots)
-    phi_n_buf = cl.Buffer(context, mem_flags.READ_ONLY | mem_flags.COPY_HOST_PTR, hostbuf=self.phi_n)
-    a_n_buf = cl.Buffer(context, mem_flags.READ_ONLY | mem_flags.COPY_HOST_PTR, hostbuf=self.a_n)
-    i_pars_buf = cl.Buffer(context, mem_flags.READ_ONLY | mem_flags.COPY_HOST_PTR, hostbuf=self.i_pars)
-    f_pars_buf = cl.Buffer(context, mem_flags.READ_ONLY | mem_flags.COPY_HOST_PTR, hostbuf=self.f_pars)
-
-    # Estimate total size of all global arrays that will be copied to local memory:
-    to_local = [phi_n_buf,a_n_buf,phi_knots_buf,phi_c_buf,a_c_buf]
-    tot_local_per_instance = functools.reduce(lambda a,b:a+b,list(map(lambda x:sys.getsizeof(x),to_local)))
-    workgroup_size = n_instances/local_size
-    #print(f"estimated total size of local arrays: {tot_local_per_instance*workgroup_size/1024.0} kb per workgroup")
-   
-    program.oscillator(queue, (n_instances,), (local_size,),
-                       y_buf,
-                       err_buf,error_details_buf,info_buf,n_info_buf,
-                       phi_c_buf, phi_knots_buf, a_c_buf, a_knots_buf, phi_n_buf, a_n_buf,
-                       i_pars_buf,f_pars_buf)
+    err_buf,error_details_buf = errors.bufs(dev)
+    if self.lanes is not None:
+      return self.run_2d(dev,n_instances,local_size,err_buf,error_details_buf,y,wait_for)
+    uploads = []
+    for name in ['info','n_info','phi_c','phi_knots','a_c','a_knots','phi_n','a_n','mult','active','cursors','i_pars','f_pars']:
+      uploads.append(dev.upload(name,getattr(self,name),wait_for))
+    bufs = dict(map(lambda u:(u[0],u[1]),uploads))
+    events = list(map(lambda u:u[2],uploads))
+
+    kernel_event = dev.kernel('oscillator')(queue, (n_instances,), (local_size,),
+                       y,
+                       err_buf,error_details_buf,bufs['info'],bufs['n_info'],
+                       bufs['phi_c'], bufs['phi_knots'], bufs['a_c'], bufs['a_knots'], bufs['phi_n'], bufs['a_n'], bufs['mult'],
+                       bufs['active'],bufs['cursors'],
+                       bufs['i_pars'],bufs['f_pars'],
+                       wait_for=events)
     # cf. clEnqueueNDRangeKernel , enqueue_nd_range_kernel 
-    # This seems to be calling the __call__ method of a Kernel object, https://documen.tician.de/pyopencl/runtime_program.html
     # Args are (queue,global_size,local_size,*args).
     # global_size is size of m-dim rectangular grid, one work item launched for each point
     # local_size is size of workgroup, must be an integer divisor of global_size
 
-    cl.enqueue_copy(queue, self.err, err_buf)
-    cl.enqueue_copy(queue, self.error_details, error_details_buf)
-    cl.enqueue_copy(queue, self.y, y_buf)
-
-    have_errors = False
-    for i in range(n_instances):
-      if self.err[i]!=0:
-        print(f"instance {i}, error={error_to_string(int(self.err[i]/1000))}, oscillator.cl line {self.err[i]%1000}")
-        k = 64*i
-        print(f"  details: {self.error_details[k]}, {self.error_details[k+1]}, {self.error_details[k+2]}")
-        have_errors = True
-    if have_errors:
-      self.my_errors = 1
+    return [kernel_event]
+
+  def run_2d(self,dev,n_instances,local_size,err_buf,error_details_buf,y,wait_for):
+    """
+    The part of run() that launches the oscillator_2d kernel, whose workgroups are local_size by self.lanes. The kernel culls
+    partials per workgroup, so a partial is active for a group if it's active for any of the group's instances.
+    """
+    lanes = self.lanes
+    if lanes<1 or (lanes&(lanes-1))!=0:
+      raise Exception(f"lanes={lanes} is not a power of 2")
+    if local_size*lanes>MAX_LOCAL_2D:
+      raise Exception(f"local_size*lanes={local_size*lanes} is greater than MAX_LOCAL_2D={MAX_LOCAL_2D}")
+    words = self.parent.limits['ACTIVE_MASK_WORDS']
+    self.group_active = numpy.bitwise_or.reduce(self.active.reshape(n_instances//local_size,local_size,words),axis=1).flatten()
+    uploads = list(map(lambda name:dev.upload(name,getattr(self,name),wait_for),
+              ['phi_c','phi_knots','a_c','a_knots','phi_n','a_n','mult','group_active','i_pars','f_pars']))
+    bufs = list(map(lambda u:u[1],uploads))
+    kernel_event = dev.kernel('oscillator_2d')(dev.queue, (n_instances,lanes), (local_size,lanes), y, err_buf, error_details_buf,
+                                   *bufs,wait_for=list(map(lambda u:u[2],uploads)))
+    return [kernel_event]
+
+  def run_numpy(self,dev,errors,y):
+    # Same as run(), but for a NumpyDevice, which works directly on numpy arrays.
+    dev.oscillator(y,errors.err,self.phi_c,self.phi_knots,self.a_c,self.a_knots,self.phi_n,self.a_n,self.mult,self.active,
+                   self.i_pars,self.f_pars)
+
+class OscillatorWindowed(OscillatorLowLevel):
+  """
+  Like OscillatorLowLevel, but for the oscillator_windowed kernel, so there is no limit on the number of knots in the whole
+  note, only on the number that each workgroup needs for the samples it's responsible for. The spline data are flattened in
+  the same way as for OscillatorBatch, and at run time, when we know the size of the workgroups, we make a table of the window
+  of each spline that each workgroup needs.
+  """
+  def clear_small_arrays(self):
+    self.i_pars = numpy.zeros(100, numpy.int64)
+    self.f_pars = numpy.zeros(100, numpy.float32)
+
+  def setup(self,partials):
+    self.clear()
+    self.partials = partials
+    if len(partials)>self.parent.limits['MAX_PARTIALS']:
+      raise Exception(f"{len(partials)} partials is more than the limit of {self.parent.limits['MAX_PARTIALS']}")
+    self.phi_c = numpy.concatenate(list(map(lambda p:p.phi.c.flatten(),partials))).astype(numpy.float32)
+    self.phi_knots = numpy.concatenate(list(map(lambda p:p.phi.x,partials))).astype(numpy.float32)
+    self.a_c = numpy.concatenate(list(map(lambda p:p.a.c.flatten(),partials))).astype(numpy.float32)
+    self.a_knots = numpy.concatenate(list(map(lambda p:p.a.x,partials))).astype(numpy.float32)
+    phi_n = numpy.array(list(map(lambda p:len(p.phi.x),partials)))
+    a_n = numpy.array(list(map(lambda p:len(p.a.x),partials)))
+    self.partial_i = numpy.stack([phi_n,a_n,starts((phi_n-1)*(PHASE_SPLINE_ORDER+1)),starts(phi_n),
+                                  starts((a_n-1)*(A_SPLINE_ORDER+1)),starts(a_n)],axis=1).astype(numpy.int32).flatten()
+    t1 = self.t0+self.dt*self.n_samples
+    if not (self.in_time_range(self.t0) and self.in_time_range(t1)):
+      raise Exception(f"illegal time range, t={self.t0} to {t1} is not within time range of partials, which is {self.defined_time_range()}")
+    self.f_pars[0] = self.t0
+    self.f_pars[1] = self.dt
+    self.i_pars[0] = self.samples_per_instance
+    self.i_pars[1] = len(partials)
+    self.i_pars[2] = self.n_samples
+    self.i_pars[3] = self.offset
+    self.i_pars[6] = int(self.incremental)
+
+  def windows(self,n_instances,local_size):
+    """
+    Returns the table window_i described in the comments on fn_osc_windowed() in oscillator.cl. The window for a spline is
+    the knots that Partial.restrict() would keep for the workgroup's time range, plus one more interval at the left, so that
+    rounding of the times on the GPU can't take us to the left of the first knot. (At the right end, spline() just uses the
+    last polynomial.) Raises an exception if a workgroup would need more knots than the limits allow; OscillatorSeq uses
+    overflow() to make sure that doesn't happen.
+    """
+    table = self.window_table(n_instances,local_size)
+    if self.window_overflow(table)>1.0:
+      raise Exception(f"a workgroup needs more than MAX_SPLINE_KNOTS={self.parent.limits['MAX_SPLINE_KNOTS']} knots; "
+                       "use more instances or a smaller local_size")
+    return table.flatten()
+
+  def overflow(self,n_instances,local_size):
+    # The most knots or coefficients that any workgroup needs, as a fraction of the limit, so that >1 means they don't fit.
+    return self.window_overflow(self.window_table(n_instances,local_size))
+
+  def window_table(self,n_instances,local_size):
+    # The table returned by windows(), with shape (groups,partials,WINDOW_I_SIZE).
+    per_group = self.samples_per_instance*local_size
+    n_groups = n_instances//local_size
+    j1 = numpy.minimum(numpy.arange(n_groups)*per_group,self.n_samples-1) # groups that have no samples get the last one
+    j2 = numpy.minimum(j1+per_group,self.n_samples)-1
+    t1 = self.t0+j1*self.dt
+    t2 = self.t0+j2*self.dt
+    table = numpy.zeros((n_groups,len(self.partials),WINDOW_I_SIZE),numpy.int32)
+    for m in range(len(self.partials)):
+      for (col,x) in [(0,self.partials[m].phi.x),(2,self.partials[m].a.x)]:
+        x = numpy.asarray(x,dtype=numpy.float64)
+        lo = numpy.maximum(numpy.searchsorted(x[1:],t1,'left')-1,0)
+        hi = numpy.searchsorted(x[:-1],t2,'right')
+        table[:,m,col] = lo
+        table[:,m,col+1] = hi-lo+1
+    return table
+
+  def window_overflow(self,table):
+    limits = self.parent.limits
+    result = 0.0
+    for (col,order) in [(1,PHASE_SPLINE_ORDER),(3,A_SPLINE_ORDER)]:
+      n_knots = numpy.max(numpy.sum(table[:,:,col],axis=1))
+      result = max(result,n_knots/limits['MAX_SPLINE_KNOTS'],(n_knots-len(self.partials))*(order+1)/limits['MAX_SPLINE_COEFFS'])
+    return result
+
+  def run(self,dev,n_instances,local_size,errors,y,accumulate,wait_for=None):
+    # See OscillatorLowLevel.run().
+    if n_instances%local_size!=0:
+      raise Exception(f"local_size={local_size} is not a divisor of n_instances={n_instances}")
+    if n_instances>self.parent.limits['MAX_INSTANCES']:
+      raise Exception(f"n_instances={n_instances} is greater than {self.parent.limits['MAX_INSTANCES']}")
+    self.i_pars[4] = int(accumulate)
+    if dev.backend=='numpy':
+      self.run_numpy(dev,errors,y)
+      return []
+    self.window_i = self.windows(n_instances,local_size)
+    err_buf,error_details_buf = errors.bufs(dev)
+    uploads = list(map(lambda name:dev.upload(name,getattr(self,name),wait_for),
+              ['phi_c','phi_knots','a_c','a_knots','partial_i','window_i','i_pars','f_pars']))
+    bufs = list(map(lambda u:u[1],uploads))
+    kernel_event = dev.kernel('oscillator_windowed')(dev.queue, (n_instances,), (local_size,), y, err_buf, error_details_buf, *bufs,
+                                   wait_for=list(map(lambda u:u[2],uploads)))
+    return [kernel_event]
+
+  def run_numpy(self,dev,errors,y):
+    dev.oscillator_windowed(y,errors.err,self.phi_c,self.phi_knots,self.a_c,self.a_knots,self.partial_i,self.i_pars,self.f_pars)
+
+  def __str__(self):
+    return "defined time range = "+str(self.defined_time_range())+"\n"
+
+class OscillatorBatch:
+  """
+  Many notes, each with its own partials, rendered by a single kernel launch and mixed into one output buffer. This avoids paying
+  for a separate set of buffer allocations, launch, and readback for every note of a score.
+  """
+  def __init__(self,pars,notes):
+    """
+    pars should contain keys n_samples, n_instances, and dt; n_samples is the length of the whole output buffer
+    notes is a list of dicts, each with keys partials, t0, n_samples, and offset; t0 is the value of the note's time variable at
+    which to start, and offset is the index in the output buffer at which the note's first sample goes
+    """
+    self.n_samples,self.dt,self.n_instances = (pars['n_samples'],pars['dt'],pars['n_instances'])
+    self.samples_per_instance = int(self.n_samples/self.n_instances)
+    if self.samples_per_instance*self.n_instances<self.n_samples:
+      self.samples_per_instance += 1
+    self.y = None # results of synthesis, filled in by run()
+    self.errors = None
+    self.setup(notes)
+
+  def setup(self,notes):
+    """
+    Flatten the knots and coefficients of all the partials of all the notes, in the same format used by OscillatorLowLevel.setup(),
+    and make the tables described in the comments on fn_osc_batch() in oscillator.cl.
+    """
+    if len(notes)==0:
+      raise Exception("no notes to render")
+    phi_c,phi_knots,a_c,a_knots = ([],[],[],[])
+    partial_i = [] # rows of PARTIAL_I_SIZE
+    note_i = []    # rows of NOTE_I_SIZE
+    note_f = []
+    k_phi_c,k_phi_knots,k_a_c,k_a_knots = (0,0,0,0) # running offsets into the flattened arrays
+    for note in notes:
+      partials,t0,n,offset = (note['partials'],note['t0'],note['n_samples'],note['offset'])
+      t1 = t0+self.dt*n
+      for p in partials:
+        a,b = p.time_range()
+        if not (t0>=a-0.0001 and t1<=b+0.0001):
+          raise Exception(f"illegal time range, t={t0} to {t1} is not within time range of partial, which is {(a,b)}")
+      note_i.append([len(partial_i),len(partials),offset,n])
+      note_f.append(t0)
+      for p in partials:
+        partial_i.append([len(p.phi.x),len(p.a.x),k_phi_c,k_phi_knots,k_a_c,k_a_knots])
+        phi_c.append(p.phi.c.flatten())
+        phi_knots.append(p.phi.x)
+        a_c.append(p.a.c.flatten())
+        a_knots.append(p.a.x)
+        k_phi_c += p.phi.c.size
+        k_phi_knots += len(p.phi.x)
+        k_a_c += p.a.c.size
+        k_a_knots += len(p.a.x)
+    self.phi_c = numpy.concatenate(phi_c).astype(numpy.float32)
+    self.phi_knots = numpy.concatenate(phi_knots).astype(numpy.float32)
+    self.a_c = numpy.concatenate(a_c).astype(numpy.float32)
+    self.a_knots = numpy.concatenate(a_knots).astype(numpy.float32)
+    self.partial_i = numpy.array(partial_i,dtype=numpy.int32).flatten()
+    self.note_i = numpy.array(note_i,dtype=numpy.int32).flatten()
+    self.note_f = numpy.array(note_f,dtype=numpy.float32)
+    # For each instance, make a list of the notes that overlap the samples it's responsible for.
+    spi = self.samples_per_instance
+    inst = []
+    which = []
+    for k in range(len(notes)):
+      offset,n = (note_i[k][2],note_i[k][3])
+      first = max(offset,0)//spi
+      last = min(offset+n-1,self.n_samples-1)//spi
+      if n<=0 or first>last:
+        continue # note lies entirely outside the output buffer
+      inst.append(numpy.arange(first,last+1))
+      which.append(numpy.full(last-first+1,k))
+    if len(inst)==0:
+      inst,which = ([numpy.zeros(0,numpy.int64)],[numpy.zeros(0,numpy.int64)])
+    inst = numpy.concatenate(inst)
+    which = numpy.concatenate(which)
+    order = numpy.argsort(inst,kind='stable')
+    self.inst_notes = numpy.append(which[order],0).astype(numpy.int32) # extra element so that the buffer is never empty
+    self.inst_notes_start = numpy.searchsorted(inst[order],numpy.arange(self.n_instances+1)).astype(numpy.int32)
+    self.i_pars = numpy.zeros(100, numpy.int64)
+    self.f_pars = numpy.zeros(100, numpy.float32)
+    self.i_pars[0] = spi
+    self.i_pars[1] = len(notes)
+    self.i_pars[2] = self.n_samples
+    self.f_pars[0] = self.dt
+
+  def error_code(self):
+    if self.errors is None:
+      return 0
+    return self.errors.code
+
+  def run(self,dev,local_size=None,out=None):
+    # out is an optional array to render into, which then becomes self.y; see output_array()
+    n_instances = self.n_instances
+    if local_size is None:
+      local_size = dev.launch_config()['local_size']
+    if n_instances%local_size!=0:
+      raise Exception(f"local_size={local_size} is not a divisor of n_instances={n_instances}")
+    if n_instances>dev.limits['MAX_INSTANCES']:
+      raise Exception(f"n_instances={n_instances} is greater than {dev.limits['MAX_INSTANCES']}")
+    self.y = output_array(out,self.n_samples)
+    self.errors = ErrorChannel(n_instances)
+    clear_events = self.errors.clear(dev)
+    if dev.backend=='numpy':
+      dev.oscillator_batch(self.y,self.errors.err,self.phi_c,self.phi_knots,self.a_c,self.a_knots,
+                           self.partial_i,self.note_i,self.note_f,self.i_pars,self.f_pars)
+      flush_output(self.y)
+      self.errors.check(dev)
+      return
+
+    queue = dev.queue
+    y_buf = dev.pool.get('y',self.y.nbytes)
+    err_buf,error_details_buf = self.errors.bufs(dev)
+    uploads = list(map(lambda name:dev.upload(name,getattr(self,name)),
+              ['phi_c','phi_knots','a_c','a_knots','partial_i','note_i','note_f',
+               'inst_notes_start','inst_notes','i_pars','f_pars']))
+    bufs = list(map(lambda u:u[1],uploads))
+    kernel_event = dev.kernel('oscillator_batch')(queue, (n_instances,), (local_size,), y_buf, err_buf, error_details_buf, *bufs,
+                                   wait_for=clear_events+list(map(lambda u:u[2],uploads)))
+    read_output(dev,self.y,y_buf,[(0,self.n_samples)],[kernel_event])
+    dev.finish()
+    flush_output(self.y)
+    self.errors.check(dev)
+
+class ErrorChannel:
+  """
+  Error reporting from the kernel, sized to the launch and shared by all the segments of a run.
+  err[0] is a flag that gets set if any instance of any segment has an error, and err[i+1] is the code for instance i,
+  which packs some error info in it: err*1000+line, where line is the line number in oscillator.cl.
+  error_details has ERROR_DETAILS_SIZE ints per instance, which the kernel can fill in with whatever might help.
+  Only the flag is read back routinely; the rest is only transferred if something went wrong.
+  """
+  def __init__(self,n_instances,buffers=''):
+    # buffers is a suffix for the names of the pooled device buffers, as in Oscillator.start()
+    self.n_instances,self.buffers = (n_instances,buffers)
+    self.err = numpy.zeros(n_instances+1, numpy.int32)
+    self.error_details = numpy.zeros(n_instances*ERROR_DETAILS_SIZE, numpy.int32)
+    self.code = 0 # code of the first instance with an error, filled in by check()
+    self.flag_read = None # events for the transfer of the flag, if read_flag() has enqueued it
+
+  def bufs(self,dev):
+    return (dev.pool.get('err'+self.buffers,self.err.nbytes),dev.pool.get('error_details'+self.buffers,self.error_details.nbytes))
+
+  def clear(self,dev,wait_for=None):
+    # Zero the device buffers, and return a list of events for the caller to wait on.
+    self.err.fill(0)
+    self.error_details.fill(0)
+    self.code = 0
+    if dev.backend=='numpy':
+      return []
+    return [dev.zeros('err'+self.buffers,self.err.nbytes,wait_for)[2],
+            dev.zeros('error_details'+self.buffers,self.error_details.nbytes,wait_for)[2]]
+
+  def read_flag(self,dev,wait_for=None):
+    # Enqueue the transfer of the flag, without blocking, so that check() doesn't have to wait for anything enqueued after
+    # this. Returns a list of events.
+    if dev.backend=='numpy':
+      return []
+    self.flag_read = [cl.enqueue_copy(dev.queue, self.err[0:1], self.bufs(dev)[0], is_blocking=False, wait_for=wait_for)]
+    return self.flag_read
+
+  def check(self,dev):
+    """
+    Call this after all the work has completed. Prints any errors, and returns the first error code, or 0 if there were none.
+    """
+    if dev.backend!='numpy':
+      err_buf,error_details_buf = self.bufs(dev)
+      if self.flag_read is None:
+        cl.enqueue_copy(dev.queue, self.err[0:1], err_buf) # just the flag
+      else:
+        cl.wait_for_events(self.flag_read)
+      if self.err[0]!=0:
+        cl.enqueue_copy(dev.queue, self.err, err_buf)
+        cl.enqueue_copy(dev.queue, self.error_details, error_details_buf)
+    if self.err[0]==0:
+      return 0
+    instances = numpy.flatnonzero(self.err[1:])
+    codes = self.err[1:][instances]
+    details = self.error_details.reshape(-1,ERROR_DETAILS_SIZE)[instances]
+    for i,what,line,d in zip(instances,codes//1000,codes%1000,details):
+      print(f"instance {i}, error={error_to_string(what)}, oscillator.cl line {line}")
+      print(f"  details: {d[0]}, {d[1]}, {d[2]}")
+    if len(codes)>0:
+      self.code = codes[0]
+    return self.code
+
+def check_limits(limits,dev):
+  # The data were split up according to one set of limits, so make sure we aren't trying to run them on a device that uses different ones.
+  if limits!=dev.limits:
+    raise Exception(f"oscillator was set up with limits {limits}, but device has limits {dev.limits}")
+
+def plan_segments(partials,n_samples,t0,dt,limits):
+  """
+  Cut the samples 0 through n_samples-1, at times t0+j*dt, into the smallest number of consecutive segments such that, when
+  the partials are restricted to each segment using Partial.restrict(), the knots and coefficients fit within the limits
+  for a single launch. Returns a list of (j,n), where j is the index of the first sample in a segment and n is the number
+  of samples. This is done greedily, making each segment as long as possible, which gives the fewest segments.
+  Restricting to [t1,t2] keeps the intervals between knots [x[i],x[i+1]] for which x[i+1]>=t1 and x[i]<=t2, so the number
+  of intervals kept, summed over all the partials, is the number of left ends <=t2 minus the number of right ends <t1.
+  By sorting all the left and right ends once, we can find that for any segment with a binary search.
+  """
+  n_partials = len(partials)
+  ends = []
+  for (s,order) in zip(splines(partials),[PHASE_SPLINE_ORDER,A_SPLINE_ORDER]):
+    xx = list(map(lambda spline:numpy.asarray(spline.x,dtype=numpy.float64),s))
+    left = numpy.sort(numpy.concatenate(list(map(lambda x:x[:-1],xx))))
+    right = numpy.sort(numpy.concatenate(list(map(lambda x:x[1:],xx))))
+    max_intervals = min(limits['MAX_SPLINE_KNOTS']-len(s),limits['MAX_SPLINE_COEFFS']//(order+1))
+    ends.append((left,right,max_intervals))
+  segments = []
+  j = 0
+  while j<n_samples:
+    t1 = t0+j*dt
+    k = n_samples # exclusive end of this segment
+    for (left,right,max_intervals) in ends:
+      m = max_intervals+numpy.searchsorted(right,t1,'left') # the number of left ends that are allowed to be <=t2
+      if m>=len(left):
+        continue
+      # The last sample in the segment has to come before left[m]; find the first one that doesn't.
+      kk = max(j,int(math.ceil((left[m]-t0)/dt)))
+      while kk>j and t0+(kk-1)*dt>=left[m]:
+        kk -= 1
+      while t0+kk*dt<left[m]:
+        kk += 1
+      k = min(k,kk)
+    if k<=j:
+      raise Exception(f"can't fit the partials into the limits on knots even for a single sample at t={t1}; {n_partials} partials, limits={limits}")
+    segments.append((j,k-j))
+    j = k
+  return segments
+
+def splines(partials):
+  # Returns (phase splines,amplitude splines) for a list of Partial objects or a HarmonicStack.
+  if isinstance(partials,HarmonicStack):
+    return ([partials.phi],partials.a)
+  return (list(map(lambda p:p.phi,partials)),list(map(lambda p:p.a,partials)))
+
+def restrict(partials,t1,t2):
+  # Restrict a list of Partial objects or a HarmonicStack to the time range [t1,t2].
+  if isinstance(partials,HarmonicStack):
+    return partials.restrict(t1,t2)
+  return list(map(lambda p:p.restrict(t1,t2),partials))
+
+def time_shift(partials,s):
+  # Shift a list of Partial objects or a HarmonicStack in time, so that what happened at time s happens at time 0.
+  if isinstance(partials,HarmonicStack):
+    return partials.time_shift(s)
+  return list(map(lambda p:p.time_shift(s),partials))
+
+def active_partials(partials,n_instances,samples_per_instance,t0,dt,amplitude_floor,n_words):
+  """
+  For each instance, figure out which partials need to be computed, leaving out the ones that are above the Nyquist frequency,
+  and would therefore only cause aliasing, or whose amplitude is below amplitude_floor, for the whole time range covered by
+  the instance. With vibrato, a partial can move back and forth across the Nyquist frequency during a note, so this has to be
+  done per instance rather than per note. Returns a bit mask with n_words 32-bit words per instance, in the format described
+  with IS_ACTIVE in oscillator.cl. The bounds on the splines come from interval_bounds(), and are conservative, so that we
+  only leave out a partial when we're sure it isn't needed.
+  """
+  phis,amps = splines(partials)
+  t1 = t0+numpy.arange(n_instances)*samples_per_instance*dt
+  t2 = t1+(samples_per_instance-1)*dt
+  nyquist = math.pi/dt # in radians per unit time
+  active = numpy.zeros((n_instances,32*n_words),dtype=bool)
+  min_omega = list(map(lambda phi:range_reduce(numpy.minimum,min_abs(*interval_bounds(phi,True)),phi.x,t1,t2),phis))
+  for m in range(len(amps)):
+    if isinstance(partials,HarmonicStack):
+      omega = min_omega[0]*abs(partials.multipliers[m])
+    else:
+      omega = min_omega[m]
+    lo,hi = interval_bounds(amps[m])
+    a = range_reduce(numpy.maximum,numpy.maximum(numpy.abs(lo),numpy.abs(hi)),amps[m].x,t1,t2)
+    active[:,m] = numpy.logical_and(omega<nyquist,a>=amplitude_floor)
+  return numpy.packbits(active,axis=1,bitorder='little').view('<u4').flatten()
+
+def knot_cursors(partials,n_instances,samples_per_instance,t0,dt):
+  """
+  For each instance, the knot intervals of each partial's phase and amplitude splines at the instance's first sample,
+  flattened in the format described with oscillator_cubic_spline() in oscillator.cl, so that the kernel doesn't have to
+  search for them. The choice of interval is the same as in spline() there. We look one sample early, since that's always
+  safe, and the time computed on the device could come out slightly earlier than ours due to rounding.
+  """
+  phis,amps = splines(partials)
+  t = t0+(numpy.arange(n_instances)*samples_per_instance-1)*dt
+  cursors = numpy.zeros((n_instances,len(amps),2),numpy.int32)
+  for (col,ss) in [(0,phis),(1,amps)]:
+    for m in range(len(ss)):
+      x = numpy.asarray(ss[m].x,dtype=numpy.float64)
+      cursors[:,m,col] = numpy.searchsorted(x[1:-1],t,'left')
+  return cursors.flatten()
+
+def interval_bounds(s,derivative=False):
+  """
+  Returns arrays giving lower and upper bounds on the values of the Pie s, or its derivative, on each interval between knots.
+  On an interval of width h, a polynomial c_0+c_1d+c_2d^2+... is within |c_1|h+|c_2|h^2+... of c_0.
+  """
+  c = numpy.asarray(s.c,dtype=numpy.float64)[::-1] # now row k has the coefficients of d^k
+  if derivative:
+    c = c[1:]*numpy.arange(1,len(c))[:,None]
+  h = numpy.diff(numpy.asarray(s.x,dtype=numpy.float64))
+  slack = numpy.zeros(len(h))
+  for k in range(1,len(c)):
+    slack += numpy.abs(c[k])*h**k
+  return (c[0]-slack,c[0]+slack)
+
+def min_abs(lo,hi):
+  # a lower bound on the absolute value of something that lies between lo and hi
+  return numpy.where(lo>0,lo,numpy.where(hi<0,-hi,0.0))
+
+def range_reduce(ufunc,values,x,t1,t2):
+  """
+  values has one element for each interval between the knots x. For each i, apply ufunc (numpy.maximum or numpy.minimum)
+  to the values for all the intervals that overlap [t1[i],t2[i]], which are the same ones that Pie.restrict() would keep.
+  """
+  x = numpy.asarray(x,dtype=numpy.float64)
+  lo = numpy.clip(numpy.searchsorted(x[1:],t1,'left'),0,len(values)-1)
+  hi = numpy.clip(numpy.searchsorted(x[:-1],t2,'right')-1,lo,len(values)-1)
+  # reduceat() on the pairs (lo,hi+1) gives the reductions over values[lo:hi+1]; the extra element is never actually used
+  ends = numpy.empty(2*len(lo),dtype=numpy.int64)
+  ends[0::2] = lo
+  ends[1::2] = hi+1
+  return ufunc.reduceat(numpy.append(values,values[-1]),ends)[0::2]
+
+def samples_per_instance_for(n_samples,n_instances):
+  # the smallest number of samples per instance that covers all the samples
+  samples_per_instance = int(n_samples/n_instances)
+  if samples_per_instance*n_instances<n_samples:
+    samples_per_instance += 1
+  return samples_per_instance
+
+def starts(sizes):
+  # the offset of each of a list of consecutive blocks with the given sizes
+  return numpy.concatenate([[0],numpy.cumsum(sizes)[:-1]])
+
+def output_array(out,n_samples):
+  """
+  Check an array supplied by the caller to hold the results of a synthesis, or make one if out is None. The array has to be
+  one-dimensional, float32, and contiguous, so that the results can be transferred into it directly without any copying;
+  a slice of a bigger array or a numpy.memmap is fine as long as it meets those conditions.
+  """
+  if out is None:
+    return numpy.zeros(n_samples, numpy.float32)
+  if not (isinstance(out,numpy.ndarray) and out.dtype==numpy.float32 and out.shape==(n_samples,) and out.flags['C_CONTIGUOUS']):
+    raise Exception(f"output array should be contiguous float32 with shape ({n_samples},)")
+  return out
+
+def output_buffer(dev,out,name='y'):
+  """
+  Returns the thing that the segments of a synthesis should write their samples into, for eventual transfer into the numpy
+  array out: the pooled device buffer with the given name, of the same size, on an OpenClDevice, or out itself on a NumpyDevice.
+  """
+  if dev.backend=='numpy':
+    return out
+  return dev.pool.get(name,out.nbytes) # not initialized; the first set of partials writes every sample
+
+def read_output(dev,out,y,slices,wait_for=None):
+  """
+  Enqueue the transfer of the results from y, as returned by output_buffer(), into out. This is done one segment at a time,
+  with slices being a list of (offset,n_samples), so that each segment's results land directly in their own slice of out;
+  when out is a memory map, this means that the pages can be written back to disk as we go, rather than all at once at the end.
+  """
+  if dev.backend=='numpy':
+    return []
+  events = []
+  itemsize = out.itemsize
+  for (offset,n) in slices:
+    if n>0:
+      events.append(cl.enqueue_copy(dev.queue, out[offset:offset+n], y, src_offset=offset*itemsize,
+                                    is_blocking=False, wait_for=wait_for))
+  return events
+
+def output_file(filename,n_samples):
+  """
+  Make an output array for a synthesis that's backed by a file on disk, so that a very long render doesn't have to fit in
+  memory. The file holds raw float32 samples in the machine's byte order; to make a sound file out of it, pass the array to
+  wav.write_file().
+  """
+  return numpy.memmap(filename,dtype=numpy.float32,mode='w+',shape=(n_samples,))
+
+def wait_for_events(dev,events):
+  # Block until the events are complete; there are never any on a NumpyDevice, where everything is done synchronously.
+  if len(events)>0:
+    cl.wait_for_events(events)
+
+def flush_output(out):
+  # If out is a memory map, make sure everything has been written to disk.
+  if isinstance(out,numpy.memmap):
+    out.flush()
 
 def error_to_string(n):
   s = {1:"undefined function",2:"spline too large",3:"too many partials",4:"too many knots in spline",
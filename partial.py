@@ -1,4 +1,5 @@
 import math,copy
+import numpy
 import pie
 from pie import Pie
 
@@ -42,20 +43,123 @@ class Partial:
   def restrict(self,t1,t2):
     return Partial.from_phase_and_amplitude(self.phi.restrict(t1,t2),self.a.restrict(t1,t2))
 
+  def time_shift(self,s):
+    # the same partial, shifted in time so that what happened at time s happens at time 0; see Pie.time_shift()
+    return Partial.from_phase_and_amplitude(self.phi.time_shift(s),self.a.time_shift(s))
+
   def filter(self,filt):
     """
     Do a sort of mock-up of a filter, using the function filt that takes a frequency as an input and gives a (real-valued) gain as an output.
     This is not linear, and is not really what people think of when they say "filter" in DSP. It also doesn't act on phases. It's
     designed to fit my model of synthesis and to try to do the same thing perceptually as a normal "filter."
+    filt is called only once, on a numpy array containing the frequencies at all the knots, and should return an array of gains
+    of the same shape, as the response functions in instruments.py do. A constant, such as lambda f:1.0, is also OK. To filter
+    many partials with a single call to filt, use filter_all().
+    """
+    f = self.f(self.f.x)
+    self.modulate(evaluate_response(filt,f))
+
+  def modulate(self,gains):
+    """
+    Multiply the amplitude by a smooth function that has the given values at the knots of the frequency. This is the part
+    of filter() that comes after evaluating the response function.
     """
-    modulation = []
-    for t in self.f.x:
-      f = self.f(t)
-      gain = filt(f)
-      #print(f"f={f}, gain={gain}")
-      modulation.append(gain)
-    am = Pie.join_extrema(self.f.x,modulation)
+    am = Pie.join_extrema(self.f.x,gains)
     # If knots of frequency are extrema (as expected with FM constructed by my method for vibrato), then these are also almost certainly
     # extrema of gain. There could actually be more extrema in between that we miss, as when a violin vib runs back and forth over multiple resonances
     # in a high-frequency partial.
     self.a = self.a.approx_product(am)
+
+class HarmonicStack:
+  """
+  A set of partials whose frequencies are all fixed multiples of one fundamental frequency f, as in a harmonic tone with vibrato.
+  Rather than a phase spline for every partial, there is only a single one, phi, for the fundamental, and the phase of the
+  ith partial is multipliers[i]*phi. Each partial has its own amplitude spline, a[i]. This saves a lot of memory and knots
+  compared to a list of Partial objects made with scale_f(), which all have their own copies of the same phase spline.
+  Oscillator accepts one of these in place of a list of partials.
+  """
+  def __init__(self,f,a,multipliers=None):
+    """
+    f is a Pie object giving the fundamental frequency
+    a is a list of Pie objects, the amplitudes of the partials
+    multipliers defaults to 1, 2, 3, ..., i.e., a harmonic series starting from the fundamental
+    """
+    self.f = f
+    self.phi = f.scalar_mult(math.pi*2.0).antiderivative()
+    self.a = list(a)
+    if multipliers is None:
+      multipliers = list(range(1,len(self.a)+1))
+    self.multipliers = list(multipliers)
+    if len(self.multipliers)!=len(self.a):
+      raise Exception(f"in constructor for HarmonicStack, {len(self.a)} amplitudes but {len(self.multipliers)} multipliers")
+    for a in self.a:
+      if a.order()!=3:
+        raise Exception(f"in constructor for HarmonicStack, amplitude is not a cubic polynomial, has order {a.order()} instead")
+    if self.phi.order()!=4:
+      raise Exception(f"in constructor for HarmonicStack, phase is not a quartic polynomial, has order {self.phi.order()} instead")
+
+  @classmethod
+  def from_phase_and_amplitudes(cls,phi,a,multipliers,f=None):
+    # Like Partial.from_phase_and_amplitude(), this keeps the constant of integration in phi. If f, the fundamental in Hz,
+    # isn't given, it's recovered from phi, which is in radians.
+    if f is None:
+      f = phi.derivative().scalar_mult(1.0/(2.0*math.pi))
+    result = cls(f,a,multipliers)
+    result.phi = phi
+    return result
+
+  def __len__(self):
+    return len(self.a)
+
+  def time_range(self):
+    a,b = self.phi.time_range()
+    for amp in self.a:
+      (aa,bb) = amp.time_range()
+      a = max(a,aa)
+      b = min(b,bb)
+    return (a,b)
+
+  def integer_multipliers(self):
+    # True if the multipliers are integers in increasing order, as in a harmonic series, possibly with some missing.
+    m = self.multipliers
+    return all(map(lambda i:m[i]==int(m[i]) and m[i]>=1 and (i==0 or m[i]>m[i-1]),range(len(m))))
+
+  def subset(self,k1,k2):
+    # The partials with indices k1 through k2-1, sharing the same phase.
+    return HarmonicStack.from_phase_and_amplitudes(self.phi,self.a[k1:k2],self.multipliers[k1:k2],self.f)
+
+  def restrict(self,t1,t2):
+    return HarmonicStack.from_phase_and_amplitudes(self.phi.restrict(t1,t2),list(map(lambda a:a.restrict(t1,t2),self.a)),
+                                                   self.multipliers,self.f.restrict(t1,t2))
+
+  def time_shift(self,s):
+    return HarmonicStack.from_phase_and_amplitudes(self.phi.time_shift(s),list(map(lambda a:a.time_shift(s),self.a)),
+                                                   self.multipliers,self.f.time_shift(s))
+
+  def partials(self):
+    # The equivalent list of Partial objects.
+    return list(map(lambda i:Partial.from_phase_and_amplitude(self.phi.scalar_mult(self.multipliers[i]),self.a[i]),
+                    range(len(self.a))))
+
+  def filter(self,filt):
+    # Same as Partial.filter() for each partial, but with a single call to filt for all of them.
+    f = numpy.outer(self.multipliers,self.f(self.f.x)) # row i has the frequencies of partial i at the knots
+    gains = evaluate_response(filt,f.flatten()).reshape(f.shape)
+    for i in range(len(self.a)):
+      self.a[i] = self.a[i].approx_product(Pie.join_extrema(self.f.x,gains[i]))
+
+def filter_all(partials,filt):
+  """
+  Same as doing p.filter(filt) for each Partial p in the list partials, but with a single call to filt, on the frequencies at
+  the knots of all the partials.
+  """
+  f = list(map(lambda p:p.f(p.f.x),partials))
+  gains = evaluate_response(filt,numpy.concatenate(f))
+  ends = numpy.cumsum(list(map(len,f)))
+  for i in range(len(partials)):
+    partials[i].modulate(gains[ends[i]-len(f[i]):ends[i]])
+
+def evaluate_response(filt,f):
+  # Call the response function filt on the array of frequencies f, and return an array of gains of the same shape, even if
+  # filt returns a scalar.
+  return numpy.broadcast_to(numpy.asarray(filt(f),dtype=numpy.float64),f.shape)
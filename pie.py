@@ -23,6 +23,16 @@ class Pie(PPoly):
   def __init__(self,p):
     super(Pie,self).__init__(p.c,p.x)
 
+  @classmethod
+  def from_arrays(cls,c,x):
+    """
+    Constructor that takes the coefficients and knots directly, in the format used by PPoly, without making an intermediate
+    object. The arrays are used as they are, not copied.
+    """
+    result = cls.__new__(cls)
+    super(Pie,result).__init__(c,x)
+    return result
+
   @classmethod
   def from_string(cls,s,last_pair=None):
     """
@@ -67,9 +77,7 @@ class Pie(PPoly):
 
   def scalar_mult(self,s):
     r = copy.deepcopy(self)
-    for i in range(len(r.c)):
-      for j in range(len(r.c[i])):
-        r.c[i][j] = s*r.c[i][j]
+    r.c = s*r.c
     return r
 
   def time_range(self):
@@ -99,43 +107,90 @@ class Pie(PPoly):
   @classmethod
   def join(cls,a):
     """
-    Pie.join([p1,p2,...]) returns a Pie made by concatenating p1, p2, ...
+    Pie.join([p1,p2,...]) returns a Pie made by concatenating p1, p2, ..., with the same rules as cat(). Rather than
+    concatenating them one at a time, which would be quadratic in the number of pieces, we allocate the coefficient and
+    knot arrays for the result once and copy each piece into its place. If the pieces have different orders, the lower-order
+    ones are padded with zeroes.
     """
+    for i in range(len(a)-1):
+      if abs(a[i].x[-1]-a[i+1].x[0])>3.0e-5: # same tolerance as in cat()
+        raise Exception(f"endpoints {a[i].x[-1]} and {a[i+1].x[0]} do not coincide")
+    order = max(map(lambda p:p.order(),a))
+    n = list(map(lambda p:len(p.x)-1,a)) # number of intervals in each piece
+    c = numpy.zeros((order+1,sum(n)),dtype=numpy.float64)
+    x = numpy.empty(sum(n)+1,dtype=numpy.float64)
+    x[0] = a[0].x[0]
+    j = 0
     for i in range(len(a)):
-      aa = a[i]
-      if i==0:
-        result = copy.deepcopy(aa)
-      else:
-        result = result.cat(aa)
-    return result
+      c[order-a[i].order():,j:j+n[i]] = a[i].c
+      x[j+1:j+n[i]+1] = a[i].x[1:]
+      j += n[i]
+    return Pie.from_arrays(c,x)
+
+  def time_shift(self,s):
+    """
+    Returns q such that q(t)=p(t+s). Only the knots move, since the coefficients are relative to the start of each interval.
+    """
+    return Pie.from_arrays(self.c.copy(),self.x-s)
 
   def restrict(self,t1,t2):
     """
-    Create a new Pie object by restricting the range of the t variable to [t1,t2].
+    Create a new Pie object by restricting the range of the t variable to [t1,t2]. The intervals we keep are the ones that
+    overlap [t1,t2], found by binary search, and only their data are copied.
     """
     self.assert_valid()
     n = len(self.x)
-    # by default we need them all:
-    lo_i = 0
-    hi_i = n-1
-    # which don't we need?
-    for i in range(n):
-      if i+1<=n-1 and t1>self.x[i+1]: # [i,i+1] is too early to be needed
-        lo_i = i+1
-    for i in range(n-2,-1,-1): # count from n-2 down to 0
-      if i>=0 and t2<self.x[i]: # [i,i+1] is too late to be needed
-        hi_i = i
-    result = copy.deepcopy(self)
-    result.x = result.x[lo_i:hi_i+1] # python's slice method is defined such that this copies indices lo_i through hi_i
-    # now make c the desired thing, which means it covers indices lo_i through hi_i-1
-    new_c = []
-    for row in result.c:
-      new_row = row[lo_i:hi_i]
-      new_c.append(new_row)
-    result.c = numpy.asarray(new_c, dtype=numpy.float)
+    lo_i = numpy.searchsorted(self.x[1:],t1,'left') # [i,i+1] is too early to be needed if t1>x[i+1]
+    hi_i = numpy.searchsorted(self.x[:n-1],t2,'right') # ... and too late if t2<x[i]; hi_i=n-1 if none is
+    if hi_i<=lo_i:
+      raise Exception(f"[{t1},{t2}] does not overlap the time range {self.time_range()}")
+    # The result has knots lo_i through hi_i, and c covers indices lo_i through hi_i-1.
+    result = Pie.from_arrays(self.c[:,lo_i:hi_i].copy(),self.x[lo_i:hi_i+1].copy())
     result.assert_valid()
     return result
 
+  def solve_increasing(self,y,tol=1.0e-14,max_iter=100):
+    """
+    For a Pie that is increasing, find the solutions t of p(t)=y for all the values in the array y at once. Each y is
+    bracketed by the values at the knots, which tells us the interval its solution lies in, and then all the roots are
+    polished together by Newton's method, falling back on bisection for any step that would leave its bracket. Since
+    each y is assigned to exactly one interval, a root that falls on a knot is found only once. Where y is outside
+    the range of p on its domain, the result is nan. Raises an exception if p is not increasing at the knots.
+    """
+    y = numpy.asarray(y,dtype=numpy.float64)
+    n = len(self.x)-1 # number of intervals
+    h = numpy.diff(self.x)
+    p = numpy.append(self.c[-1],self(self.x[-1])) # values at the knots, using the polynomial to the right except at the end
+    if not numpy.all(numpy.diff(p)>0.0):
+      raise Exception("Pie is not increasing, so the solutions are not unique")
+    result = numpy.full(y.shape,numpy.nan)
+    inside = numpy.logical_and(y>=p[0],y<=p[-1])
+    yy = y[inside]
+    i = numpy.minimum(numpy.searchsorted(p,yy,side='right')-1,n-1) # p[i]<=yy<p[i+1], except at the very end
+    c = self.c[:,i]
+    lo = numpy.zeros(len(yy)) # bracket, in terms of the local variable s=t-x[i]
+    hi = h[i]
+    s = hi*(yy-p[i])/(p[i+1]-p[i]) # initial guess by linear interpolation
+    for it in range(max_iter):
+      v = c[0]
+      dv = numpy.zeros(len(yy))
+      for m in range(1,len(c)):
+        dv = dv*s+v
+        v = v*s+c[m] # Horner's rule
+      v = v-yy
+      lo = numpy.where(v<0.0,s,lo)
+      hi = numpy.where(v>0.0,s,hi)
+      with numpy.errstate(divide='ignore',invalid='ignore'):
+        s_new = s-v/dv
+      s_new = numpy.where(numpy.logical_and(s_new>=lo,s_new<=hi),s_new,0.5*(lo+hi)) # also catches dv=0
+      s_new = numpy.where(v==0.0,s,s_new)
+      done = numpy.all(numpy.abs(s_new-s)<=tol*h[i])
+      s = s_new
+      if done:
+        break
+    result[inside] = self.x[i]+s
+    return result
+
   def assert_valid(self):
     if self.x.shape[0]!=self.c.shape[1]+1:
       raise Exception(f'shapes of x and c in {self} are not compatible, should have self.x.shape[0]=self.c.shape[1]+1')
@@ -175,11 +230,17 @@ class Pie(PPoly):
     """
     Inputs data points (t1,y1), (t2,y2), ..., which are taken as extrema of a smooth curve.
     Outputs a piecewise polynomial consisting of clamped cubic splines connecting these points.
+    A clamped cubic through two points, i.e., one with zero derivative at both ends, is y1+3(y2-y1)s^2-2(y2-y1)s^3, where
+    s=(t-t1)/(t2-t1), so all the pieces can be built at once without calling CubicSpline for each one.
     """
-    p = []
-    for i in range(len(t)-1):
-      p.append(Pie(scipy.interpolate.CubicSpline([t[i],t[i+1]],[y[i],y[i+1]],bc_type='clamped')))
-    return Pie.join(p)
+    t = numpy.asarray(t,dtype=numpy.float64)
+    y = numpy.asarray(y,dtype=numpy.float64)
+    h = numpy.diff(t)
+    if numpy.any(h<=0.0):
+      raise ValueError(f"times of extrema must be strictly increasing, t={t}")
+    dy = numpy.diff(y)
+    c = numpy.array([-2.0*dy/h**3,3.0*dy/h**2,numpy.zeros(len(h)),y[:-1]])
+    return Pie.from_arrays(c,t)
 
   def approx_product(self,q,min_h=0.001):
     return Pie.arith(self,q,min_h,op='*')
@@ -197,76 +258,63 @@ class Pie(PPoly):
     When knots from the two different functions lie within min_h of each other, we delete the one from q.
     The time range of the result is guaranteed to be the same as the time range of self.
     """
-    self_x_set = set(self.x)
-    q_x_set = set(q.x)
-    u = self_x_set.union(q_x_set) # union of knots of the two functions
-    l = sorted(list(u))
-    # Get rid of very short pieces.
-    new_l = [l[0]]
-    for i in range(len(l)-1):
-      t1 = new_l[-1]
-      t2 = l[i+1]
-      if abs(t1-t2)>min_h or (t1 in self_x_set and t2 in self_x_set) or (t1 in q_x_set and t2 in q_x_set):
-        new_l.append(t2)
+    only_q = numpy.isin(q.x,self.x,invert=True) # knots of q that aren't also knots of self
+    l = numpy.concatenate((self.x,q.x[only_q]))
+    order = numpy.argsort(l,kind='stable')
+    l = l[order]
+    # For each knot in the union, whether it's a knot of self and whether it's a knot of q.
+    from_self = numpy.concatenate((numpy.ones(len(self.x),dtype=bool),numpy.zeros(numpy.count_nonzero(only_q),dtype=bool)))[order]
+    from_q = numpy.isin(l,q.x)
+    # Get rid of very short pieces. Each kept knot depends on the one kept before it, so this has to be a loop, but it only
+    # does comparisons.
+    l,from_self,from_q = (l.tolist(),from_self.tolist(),from_q.tolist())
+    keep = [0] # indices into l
+    for i in range(1,len(l)):
+      k = keep[-1]
+      if abs(l[k]-l[i])>min_h or (from_self[k] and from_self[i]) or (from_q[k] and from_q[i]):
+        keep.append(i)
       else:
         # Figure out which is the one from q.
-        if not (t2 in q_x_set):
-          new_l[-1] = t2 # keep the one from self
-    new_x = numpy.asarray(new_l,dtype=numpy.float) 
+        if not from_q[i]:
+          keep[-1] = i # keep the one from self
+    new_x = numpy.asarray(l,dtype=numpy.float64)[keep]
+    # Evaluate P, Q, P', and Q' at the end-points of all the intervals at once.
+    x1 = new_x[:-1]
+    x2 = new_x[1:]
+    h = x2-x1
+    eps = h*1.0e-5
+    p1 = self(x1)
+    p2 = self(x2)
+    q1 = q(x1)
+    q2 = q(x2)
     pd = self.derivative()
     qd = q.derivative()
-    polys = []
-    for i in range(len(new_x)-1):
-      x1 = new_x[i]
-      x2 = new_x[i+1]
-      h = x2-x1
-      eps = h*1.0e-5
-      # Evaluate P, Q, P', and Q' at the end-points.
-      p1 = self(x1)
-      p2 = self(x2)
-      q1 = q(x1)
-      q2 = q(x2)
-      p1d = pd(x1+eps)
-      p2d = pd(x2-eps)
-      q1d = qd(x1+eps)
-      q2d = qd(x2-eps)
-      if op=='+':
-        # Define R(x)=P(x)+Q(x).
-        r1 = p1+q1
-        r2 = p2+q2
-        r1d = p1d+q1d
-        r2d = p2d+q2d
-      if op=='*':
-        # Define R(x)=P(x)Q(x).
-        r1 = p1*q1
-        r2 = p2*q2
-        # Use Leibniz rule to evaluate R and R' at the end-points.
-        r1d = p1*q1d+p1d*q1
-        r2d = p2*q2d+p2d*q2
-      # Find a+bx+cx^2+dx^3 that matches R and R' at the endpoints.
-      j,k,l,m = Pie.invert_2x2(h**2,h**3,2*h,3*h**2)
-      a = r1
-      b = r1d
-      d1 = r2-a-b*h
-      d2 = r2d-b
-      c = j*d1+k*d2
-      d = l*d1+m*d2
-      polys.append([a,b,c,d])
+    p1d = pd(x1+eps)
+    p2d = pd(x2-eps)
+    q1d = qd(x1+eps)
+    q2d = qd(x2-eps)
+    if op=='+':
+      # Define R(x)=P(x)+Q(x).
+      r1 = p1+q1
+      r2 = p2+q2
+      r1d = p1d+q1d
+      r2d = p2d+q2d
+    if op=='*':
+      # Define R(x)=P(x)Q(x).
+      r1 = p1*q1
+      r2 = p2*q2
+      # Use Leibniz rule to evaluate R and R' at the end-points.
+      r1d = p1*q1d+p1d*q1
+      r2d = p2*q2d+p2d*q2
+    # Find a+bx+cx^2+dx^3 that matches R and R' at the endpoints, i.e., cubic Hermite interpolation.
+    a = r1
+    b = r1d
+    slope = (r2-r1)/h
+    c = (3.0*slope-2.0*r1d-r2d)/h
+    d = (r1d+r2d-2.0*slope)/(h*h)
     result = copy.deepcopy(self)
     result.x = new_x
-    # flip and twist coeffs into the weird form used by PPoly
-    new_c = []
-    for row_num in range(4):
-      new_row = []
-      for col_num in range(len(polys)):
-        new_row.append(polys[col_num][3-row_num])
-      new_c.append(new_row)
-    result.c = numpy.asarray(new_c, dtype=numpy.float)
+    result.c = numpy.array([d,c,b,a],dtype=numpy.float64) # highest power first, as in PPoly
     result.assert_valid()
     return result
 
-  @staticmethod
-  def invert_2x2(a,b,c,d):
-    det = a*d-b*c
-    return (d/det,-b/det,-c/det,a/det)
-
@@ -1,14 +1,326 @@
 #!/bin/python3
 
-import math
+import math,os,struct,tempfile
+import numpy,scipy.io.wavfile
 from pie import Pie
+import partial
+from partial import Partial,HarmonicStack
+import instruments
+import wav
+import constants,oscillator
+from oscillator import Oscillator,OscillatorSeq,OscillatorBatch
+from numpy_device import NumpyDevice
 
 def main():
   assert_equal( Pie.from_string("0 0,1 1").restrict(0.3,0.7)(0.4) , 0.4 )
   assert_equal( Pie.from_string("0 0,1 1,2 2").restrict(0.3,0.7)(0.4) , 0.4 )
+  r = Pie.from_string("0 0,1 1 ; , 2 3 ; , 3 2")
+  assert_equal( r.restrict(1.5,2.5)(1.75) , r(1.75) )
+  assert_equal( Pie.join([r.restrict(0.0,0.9),r.restrict(1.1,3.0)])(2.5) , r(2.5) )
+  try:
+    Pie.join_extrema([0.0,1.0,1.0,2.0],[0.0,1.0,2.0,3.0])
+    barf(["join_extrema should reject repeated times"])
+  except ValueError:
+    pass
+  y = [-1.0,0.0,0.5,1.0,2.9,3.0,4.0]
+  roots = Pie.join_extrema([0.0,1.0,2.0],[0.0,1.0,3.0]).solve_increasing(y)
+  assert_boolean( math.isnan(roots[0]) and math.isnan(roots[6]) , "solve_increasing should give nan outside the range" )
+  for k in range(1,6):
+    assert_equal( Pie.join_extrema([0.0,1.0,2.0],[0.0,1.0,3.0])(roots[k]) , y[k] )
+  p,q = (Pie.from_string("0 0,1 1,2 0"),Pie.from_string("0 1,0.5 2,2 1"))
+  assert_equal( p.scalar_mult(3.0)(0.7) , 3.0*p(0.7) )
+  assert_equal_eps( p.sum(q)(0.7) , p(0.7)+q(0.7) , 1.0e-4 ) # exact except for the offsets used in evaluating derivatives
+  assert_equal_eps( p.approx_product(q)(0.7) , p(0.7)*q(0.7) , 0.01 )
+  filt = lambda f:1.0+f/1000.0
+  u,v = (Partial(Pie.join_extrema([0.0,1.0,2.0],[300.0,310.0,300.0]),q),Partial(Pie.from_string("0 600,2 620"),q))
+  w = Partial(u.f,q)
+  w.filter(filt)
+  partial.filter_all([u,v],filt)
+  assert_equal( u.a(0.7) , w.a(0.7) )
+  w.filter(lambda f:2.0) # a response that doesn't depend on f can return a scalar
+  assert_equal_eps( w.a(0.7) , 2.0*u.a(0.7) , 0.01 )
+  assert_equal_eps( v.a(2.0) , q(2.0)*filt(620.0) , 1.0e-6 )
+  stack = HarmonicStack(u.f,[q,q],[1,3])
+  for s in [HarmonicStack.from_phase_and_amplitudes(stack.phi,stack.a,stack.multipliers),stack.restrict(0.5,1.5)]:
+    assert_equal_eps( s.f(0.7) , u.f(0.7) , 1.0e-6 ) # in Hz, not radians/s
+    assert_equal_eps( s.phi(0.7) , stack.phi(0.7) , 1.0e-6 )
+  assert_equal( stack.restrict(1.2,1.5).f.time_range()[0] , 1.0 ) # restricted along with phi and a
+  for f in [15.0,290.0,465.1,2633.4,7000.0,50000.0]:
+    assert_rel_equal_eps( instruments.fisher_response(f) , instruments.fisher_response_exact(f) , 0.03 )
+  test_wav()
+  test_plan_segments()
+  test_numpy_device()
+  test_batch(NumpyDevice())
+  test_active_partials()
+  test_stream(NumpyDevice())
+  test_windowed(NumpyDevice())
+  dev = opencl_device()
+  if dev is None:
+    print("pyopencl or an OpenCL device isn't available, skipping the tests that need them")
+    return
+  test_batch(dev)
+  test_stream(dev)
+  test_windowed(dev)
+  test_recurrence(dev)
+  test_forward_differences(dev)
+  test_lanes(dev)
+
+def opencl_device():
+  # An OpenClDevice with the kernel built, not using any saved tuning, or None if there is no pyopencl or no OpenCL device.
+  try:
+    from opencl_device import OpenClDevice
+    dev = OpenClDevice(use_tuning=False)
+  except Exception:
+    return None
+  dev.build(os.path.join(os.path.dirname(os.path.abspath(__file__)),'oscillator.cl'))
+  return dev
+
+def test_recurrence(dev):
+  # A HarmonicStack rendered with the recurrence for sin(n*phi), without it, and by NumpyDevice, which always calls sin().
+  # The multipliers have small gaps, a gap bigger than RECURRENCE_ANCHOR, and runs longer than it, and the partials that
+  # are left out, because they're silent or because the glide takes them above the Nyquist frequency partway through,
+  # make the recurrence skip some n.
+  sample_freq = 44100.0
+  length = 0.3
+  multipliers = [1,2,3,5,6,8]+list(range(9,30))+[50,51]+list(range(52,60,2))
+  f = Pie.join_extrema(numpy.linspace(0.0,length,7),numpy.linspace(320.0,400.0,7))
+  envelope = Pie.from_string(f"0 0,0.05 1 c ; , {length} 0")
+  a = list(map(lambda n:envelope.scalar_mult(1.0/n),multipliers))
+  a[3] = envelope.scalar_mult(0.0) # n=5
+  a[10] = envelope.scalar_mult(0.0) # n=13
+  stack = HarmonicStack(f,a,multipliers)
+  pars = {'n_samples':int(length*sample_freq),'n_instances':64,'t0':0.0,'dt':1/sample_freq}
+  ref_dev = NumpyDevice()
+  ref = Oscillator(pars,stack,ref_dev)
+  ref.run(ref_dev)
+  for recurrence in [True,False]:
+    p = dict(pars)
+    p['recurrence'] = recurrence
+    osc = Oscillator(p,stack,dev)
+    osc.run(dev)
+    assert_boolean( osc.error_code()==0 , f"error with recurrence={recurrence}" )
+    assert_equal_eps( numpy.max(numpy.abs(osc.y()-ref.y())) , 0.0 , 2.0e-3 ) # peak is 1.5; float32 phases of up to 4e4 radians
+
+def test_lanes(dev):
+  # The oscillator_2d kernel, with the partials spread across lanes, should give the same result as the one-dimensional
+  # kernel, both for a list of partials and for a HarmonicStack, whose recurrence mode it doesn't use.
+  sample_freq = 44100.0
+  length = 0.2
+  f = Pie.join_extrema(numpy.linspace(0.0,length,9),300.0*(1.0+0.01*(-1.0)**numpy.arange(9)))
+  envelope = Pie.from_string(f"0 0,0.05 1 c ; , {length} 0")
+  a = list(map(lambda n:envelope.scalar_mult(1.0/n),range(1,12)))
+  stack = HarmonicStack(f,a)
+  pars = {'n_samples':int(length*sample_freq),'n_instances':256,'t0':0.0,'dt':1/sample_freq}
+  for partials in [stack,stack.partials()]:
+    ref = Oscillator(pars,partials,dev)
+    ref.run(dev,64)
+    for lanes in [1,4]:
+      p = dict(pars)
+      p['lanes'] = lanes
+      osc = Oscillator(p,partials,dev)
+      osc.run(dev,64)
+      assert_boolean( osc.error_code()==0 , f"error with lanes={lanes}" )
+      assert_equal_eps( numpy.max(numpy.abs(osc.y()-ref.y())) , 0.0 , 1.0e-3 ) # peak is 1.7; float32, computed differently
+
+def test_forward_differences(dev):
+  # Splines evaluated by forward differences and by Horner's rule should agree with each other and with NumpyDevice. The
+  # knots are only 8 samples apart, so that each block has many of them, and dt is a power of 2, so that the knots fall
+  # exactly on samples, including the first sample of every instance, where the cursor from knot_cursors() is one early.
+  # The last partial's phase has a single interval, where it gets up to 3200 radians, which is hard on the precision.
+  sample_freq = 32768.0
+  n_samples = 4096
+  t = numpy.arange(0,n_samples+8,8)/sample_freq
+  f = Pie.join_extrema(t,500.0*(1.0+0.01*(-1.0)**numpy.arange(len(t))))
+  a = Pie.join_extrema(t,0.3+0.1*(-1.0)**numpy.arange(len(t)))
+  partials = [Partial(f,a),Partial(f,a).scale_f(3.0),Partial(Pie.from_string(f"0 4000,{t[-1]} 4200"),a)]
+  pars = {'n_samples':n_samples,'n_instances':64,'t0':0.0,'dt':1/sample_freq} # 64 samples per instance, a multiple of 8
+  ref_dev = NumpyDevice()
+  ref = Oscillator(pars,partials,ref_dev)
+  ref.run(ref_dev)
+  for incremental in [True,False]:
+    p = dict(pars)
+    p['forward_differences'] = incremental
+    osc = Oscillator(p,partials,dev)
+    osc.run(dev)
+    assert_boolean( osc.error_code()==0 , f"error with forward_differences={incremental}" )
+    assert_equal_eps( numpy.max(numpy.abs(osc.y()-ref.y())) , 0.0 , 2.0e-4 )
+
+def test_windowed(dev):
+  # Windowed mode, on a note whose knots are too dense for one launch with 256 instances, so that it has to be cut into
+  # segments. Compared with the ordinary mode.
+  length,sample_freq = (5.0,44100.0)
+  partials = []
+  for k in range(4):
+    t = numpy.linspace(0.0,length,600)
+    f = Pie.join_extrema(t,220.0*(k+1)*(1.0+0.01*(-1.0)**numpy.arange(len(t))))
+    partials.append(Partial(f,Pie.from_string(f"0 0.2,{length} 0.2")))
+  pars = {'n_samples':int(length*sample_freq),'n_instances':256,'t0':0.0,'dt':1/sample_freq}
+  ref = Oscillator(pars,partials,dev)
+  ref.run(dev)
+  pars['windowed'] = True
+  osc = Oscillator(pars,partials,dev)
+  osc.run(dev)
+  assert_boolean( osc.error_code()==0 , "error in windowed mode" )
+  config = dev.launch_config()
+  segments = osc.oseqs[0].os
+  assert_boolean( len(segments)>1 , "windowed mode should have needed more than one launch" )
+  assert_boolean( all(map(lambda o:o.overflow(pars['n_instances'],config['local_size'])<=1.0,segments)) ,
+                  "a workgroup needs more knots than the limit" )
+  assert_equal_eps( numpy.max(numpy.abs(osc.y()-ref.y())) , 0.0 , 0.01 ) # float32 phases, different segments
+
+def test_stream(dev):
+  # Rendering in windows should give the same result as rendering all at once, without setting up the whole note, and
+  # each window should be enqueued before the previous one is handed back. The note starts at t=100 s, where float32 can
+  # only resolve times to about 8 microseconds, which would be a big phase error; each launch's partials are shifted in
+  # time so that it starts at t=0, so both should still agree with the exact result.
+  sample_freq = 44100.0
+  t0 = 100.0
+  pars = {'n_samples':30000,'n_instances':64,'t0':t0,'dt':1/sample_freq}
+  f = Pie.join_extrema(t0+numpy.linspace(0.0,0.7,9),300.0*(1.0+0.01*(-1.0)**numpy.arange(9)))
+  partials = [Partial(f,Pie.from_string(f"{t0} 0,{t0+0.1} 0.5 c ; , {t0+0.7} 0")),
+              Partial(f,Pie.from_string(f"{t0} 0.2,{t0+0.7} 0.2")).scale_f(2.0)]
+  t = t0+numpy.arange(pars['n_samples'])/sample_freq
+  exact = sum(map(lambda p:p.a(t)*numpy.sin(p.phi(t)),partials))
+  osc = Oscillator(pars,partials,dev)
+  osc.run(dev)
+  assert_equal_eps( numpy.max(numpy.abs(osc.y()-exact)) , 0.0 , 1.0e-4 )
+  osc2 = Oscillator(pars,partials,dev)
+  y = numpy.concatenate(list(osc2.stream(dev,window=7000)))
+  assert_boolean( osc2.oseqs is None , "stream() shouldn't set up the whole note" )
+  assert_boolean( osc2.error_code()==0 , "error in stream()" )
+  assert_equal_eps( numpy.max(numpy.abs(y-exact)) , 0.0 , 1.0e-4 )
+  seq = OscillatorSeq(pars,partials,dev.limits)
+  y = numpy.concatenate(list(seq.stream(dev,window=7000)))
+  assert_boolean( seq.os is None , "OscillatorSeq.stream() shouldn't set up the whole note" )
+  assert_equal_eps( numpy.max(numpy.abs(y-exact)) , 0.0 , 1.0e-4 )
+  started = []
+  def make(w_pars,w_partials):
+    started.append(w_pars['n_samples'])
+    return OscillatorSeq(w_pars,w_partials,dev.limits)
+  windows = oscillator.stream_windows(make,seq,pars,partials,dev,7000,None)
+  next(windows)
+  assert_boolean( len(started)==2 , "the second window should be enqueued before the first is returned" )
+  assert_boolean( sum(map(len,windows))==pars['n_samples']-7000 and len(started)==5 , "wrong windows" )
+
+def test_numpy_device():
+  # A constant frequency and amplitude, compared with the analytic result. The kernels' inputs are float32, so the
+  # phase is only good to about 1e-5 after a tenth of a second.
+  dev = NumpyDevice(block_size=1000)
+  sample_freq = 44100.0
+  n_samples = 4410
+  p = Partial(Pie.from_string("0 440,0.2 440"),Pie.from_string("0 0.5,0.2 0.5"))
+  osc = Oscillator({'n_samples':n_samples,'n_instances':64,'t0':0.0,'dt':1/sample_freq},[p],dev)
+  osc.run(dev)
+  assert_boolean( osc.error_code()==0 , "error rendering with NumpyDevice" )
+  t = numpy.arange(n_samples)/sample_freq
+  assert_equal_eps( numpy.max(numpy.abs(osc.y()-0.5*numpy.sin(2.0*math.pi*440.0*t))) , 0.0 , 1.0e-5 )
+
+def test_wav():
+  y = numpy.array([0.0,0.5,-0.5,0.25,-1.0,1.0,0.125])
+  with tempfile.TemporaryDirectory() as d:
+    filename = os.path.join(d,'test.wav')
+    for (format,full_scale) in [('int16',32767.0),('int24',8388607.0),('float32',1.0)]:
+      wav.write_file(filename,y,44100,format,gain=1.0)
+      rate,z = scipy.io.wavfile.read(filename)
+      assert_boolean( rate==44100 and len(z)==len(y) , f"wrong rate or length reading back {format}" )
+      if format=='int24':
+        z = z/256.0 # scipy puts the 24 bits in the high bytes of an int32
+      for i in range(len(y)):
+        assert_equal_eps( z[i]/full_scale , y[i] , 1.0/full_scale )
+    wav.write_file(filename,y,48000,'int24',gain=1.0)
+    with open(filename,'rb') as f:
+      h = f.read(44)
+    riff,riff_size,wave,fmt,fmt_size = struct.unpack('<4sI4s4sI',h[0:20])
+    code,channels,rate,byte_rate,block_align,bits = struct.unpack('<HHIIHH',h[20:36])
+    data,data_size = struct.unpack('<4sI',h[36:44])
+    assert_boolean( (riff,wave,fmt,data)==(b'RIFF',b'WAVE',b'fmt ',b'data') , "wrong chunk ids in wav header" )
+    assert_boolean( (fmt_size,code,channels,rate,byte_rate,block_align,bits)==(16,1,1,48000,3*48000,3,24) , "wrong fmt chunk" )
+    assert_boolean( data_size==3*len(y) , "wrong data size" )
+    assert_boolean( riff_size==os.path.getsize(filename)-8 , "wrong RIFF size" ) # includes the pad byte, since 3*7 is odd
+    w = wav.WavWriter(filename,44100,gain=1.0)
+    w.write([0.1,0.2])
+    z = wav.sanitize(numpy.array([0.5,numpy.nan,-40000.0,40000.0,0.25],dtype=numpy.float32),w)
+    assert_boolean( list(z)==[0.5,0.0,0.0,0.0,0.25] , "sanitize should zero out NaN and out-of-range values" )
+    assert_boolean( w.illegal_at==3 and math.isnan(w.illegal_value) , "sanitize should record the first bad value" )
+    w.illegal_at = -1 # so that close() doesn't print a warning
+    w.close()
+    rate,z = scipy.io.wavfile.read(filename)
+    assert_boolean( list(z)==[3277,6553] , "convert should round to the nearest integer" )
+    for (x,expected) in [(2.0,32767),(-2.0,-32767)]:
+      assert_boolean( list(numpy.frombuffer(wav.convert(numpy.array([x]),1.0,'int16'),dtype='<i2'))==[expected] , "should clip" )
+
+def test_plan_segments():
+  # Partials with different numbers of knots, and limits small enough that we need many segments.
+  partials = []
+  for k in range(3):
+    t = numpy.linspace(0.0,1.0,20+17*k)
+    f = Pie.join_extrema(t,300.0*(k+1)*(1.0+0.01*(-1.0)**numpy.arange(len(t))))
+    a = Pie.join_extrema(numpy.linspace(0.0,1.0,5+11*k),numpy.linspace(0.5,1.0,5+11*k))
+    partials.append(Partial(f,a))
+  limits = constants.limits({'MAX_SPLINE_KNOTS':40})
+  n_samples,t0,dt = (44100,0.0,1.0/44100)
+  def fits(j,n):
+    # whether samples j through j+n-1 fit within the limits, after restricting the partials to them the same way as OscillatorSeq
+    phis,amps = oscillator.splines(oscillator.restrict(partials,t0+j*dt,t0+(j+n-1)*dt))
+    for (s,order) in [(phis,4),(amps,3)]:
+      n_knots = sum(map(lambda p:len(p.x),s))
+      n_coeffs = sum(map(lambda p:(len(p.x)-1)*(order+1),s))
+      if n_knots>limits['MAX_SPLINE_KNOTS'] or n_coeffs>limits['MAX_SPLINE_COEFFS']:
+        return False
+    return True
+  segments = oscillator.plan_segments(partials,n_samples,t0,dt,limits)
+  assert_boolean( len(segments)>1 , "plan_segments should need more than one segment" )
+  j = 0
+  for (jj,n) in segments:
+    assert_boolean( jj==j and n>0 , f"segments should tile the samples, got {segments}" )
+    assert_boolean( fits(jj,n) , f"segment {(jj,n)} doesn't fit in the limits" )
+    if jj+n<n_samples:
+      assert_boolean( not fits(jj,n+1) , f"segment {(jj,n)} could have been longer" )
+    j = jj+n
+  assert_boolean( j==n_samples , "segments should cover all the samples" )
+
+def test_batch(dev):
+  # OscillatorBatch should give the same result as rendering each note separately and mixing them. The last note starts
+  # before the beginning of the buffer, so only its end is heard.
+  sample_freq = 44100.0
+  n_samples = 22050
+  notes = []
+  for k in range(4):
+    length = 0.1+0.03*k
+    f = Pie.join_extrema([0.0,0.5*length,length],[300.0+100*k,310.0+100*k,300.0+100*k])
+    a = Pie.from_string(f"0 0,{0.5*length} 0.5 c ; , {length} 0")
+    partials = [Partial(f,a),Partial(f,a).scale_f(2.0).scale_a(0.5)]
+    notes.append({'partials':partials,'t0':0.0,'n_samples':int(length*sample_freq)-1,'offset':2000*k+500})
+  notes[-1]['offset'] = -3000
+  batch = OscillatorBatch({'n_samples':n_samples,'n_instances':64,'dt':1/sample_freq},notes)
+  batch.run(dev)
+  assert_boolean( batch.error_code()==0 , "error rendering OscillatorBatch" )
+  y = numpy.zeros(n_samples)
+  for note in notes:
+    osc = Oscillator({'n_samples':note['n_samples'],'n_instances':64,'t0':0.0,'dt':1/sample_freq},note['partials'],dev)
+    osc.run(dev)
+    skip = max(-note['offset'],0)
+    y[note['offset']+skip:note['offset']+note['n_samples']] += osc.y()[skip:]
+  eps = 1.0e-5
+  if dev.backend!='numpy':
+    eps = 2.0e-4 # the kernels do all their arithmetic in float32, and the phases get up to a few hundred radians
+  assert_equal_eps( numpy.max(numpy.abs(batch.y-y)) , 0.0 , eps )
+
+def test_active_partials():
+  # Partials above the Nyquist frequency (22050 Hz) should be left out, and all the others kept. The last partial glides
+  # up through the Nyquist frequency, so it should be kept at the beginning and left out at the end.
+  a = Pie.from_string("0 1,1 1")
+  partials = list(map(lambda f:Partial(Pie.from_string(f"0 {f},1 {f}"),a),[1000.0,21000.0,23000.0,30000.0]))
+  partials.append(Partial(Pie.join_extrema(numpy.linspace(0.0,1.0,17),numpy.linspace(21000.0,23500.0,17)),a))
+  n_instances,n_words = (16,1)
+  mask = oscillator.active_partials(partials,n_instances,2756,0.0,1/44100.0,1.0e-6,n_words)
+  active = numpy.unpackbits(mask.view(numpy.uint8).reshape(n_instances,4*n_words),axis=1,bitorder='little').astype(bool)
+  assert_boolean( numpy.all(active[:,0:2]) and not numpy.any(active[:,2:4]) , "wrong partials left out" )
+  assert_boolean( active[0,4] and not active[-1,4] , "gliding partial should be kept only while below the Nyquist frequency" )
+  assert_boolean( not numpy.any(active[:,5:]) , "bits for nonexistent partials should be clear" )
 
 def barf(dat):
-  raise Exception(' '.join(dat))
+  raise Exception(' '.join(map(str,dat)))
 
 def assert_boolean(condition,message):
   if not condition:
@@ -28,27 +28,14 @@ def generate(fc,t,rate1,rate2,width,shape_r,shape_w):
   env_w = Pie.window([0,shape_w[0]*tv,shape_w[1]*tv,t-shape_w[2]*tv,t-shape_w[3]*tv,t],0,df)
   max_n = 2*(int(t/tv)+3) # conservative upper estimate of how many vib cycles we can have
   phase = env_r.antiderivative().scalar_mult(2.0*math.pi)
-  tn = [] # array containing times of (approximated) extrema
-  for n in range(max_n):
-    roots = phase.solve(n*math.pi)
-    if len(tn)>0 and len(roots)==0:
-      continue
-    if len(roots)>1:
-      raise Exception("non-unique root for phase in vibrato")
-    te = roots[0] # time of nth extremum
-    if te>t:
-      continue
-    tn.append(te)
-  fn = [] # array containing frequencies at extrema
-  for n in range(len(tn)):
-    te = tn[n] # time of nth extremum  
-    if n%2==0:
-      sgn = 1.0
-    else:
-      sgn = -1.0
-    fn.append(fc+env_w(te)*sgn)
-  tn.append(t)
-  fn.append(fc)
+  # Times of (approximated) extrema. Since env_r is positive, phase is increasing, so there is one solution for each
+  # multiple of pi up to phase(t), and we can find them all at once. Ones beyond t come out as nan.
+  tn = phase.solve_increasing(math.pi*numpy.arange(max_n))
+  tn = tn[numpy.logical_not(numpy.isnan(tn))]
+  sgn = numpy.where(numpy.arange(len(tn))%2==0,1.0,-1.0)
+  fn = fc+env_w(tn)*sgn # frequencies at extrema
+  tn = numpy.append(tn,t)
+  fn = numpy.append(fn,fc)
   return Pie.join_extrema(tn,fn)
 
 
@@ -0,0 +1,123 @@
+"""
+Writing mono audio to a WAV file a chunk at a time, so that the results of a render can go to disk as they come in, without
+ever having the whole thing in memory as Python objects. Samples are sanitized and converted using numpy on whole chunks.
+Supported sample formats are 16- and 24-bit PCM and 32-bit float.
+"""
+
+import struct,tempfile
+import numpy
+
+# Anything outside this range, or a NaN, is treated as a bug in the synthesis and replaced with silence. This is the same
+# criterion that honk.write_file() always used.
+MAX_LEGAL = 32767.0
+
+FORMATS = {
+  # name:(bytes per sample, WAVE_FORMAT code, full scale)
+  'int16':(2,1,32767.0),
+  'int24':(3,1,8388607.0),
+  'float32':(4,3,1.0)
+}
+
+class WavWriter:
+  """
+  Usage: w = WavWriter(filename,sample_freq); w.write(chunk); ...; w.close()
+  If gain is given, each chunk is multiplied by it, in units where 1.0 is full scale, and written out immediately.
+  If gain is None, the output is normalized so that its peak is at the level peak (relative to full scale). In that case we
+  can't know the gain until we've seen all the data, so the chunks are saved in a temporary file as they come in, and then
+  at close() they are read back from it through a memory map, converted, and written out.
+  """
+  def __init__(self,filename,sample_freq,format='int16',gain=None,peak=0.3,chunk_size=1<<20):
+    if not (format in FORMATS):
+      raise Exception(f"unrecognized format {format}, should be one of {list(FORMATS.keys())}")
+    self.filename,self.sample_freq,self.format,self.gain,self.peak,self.chunk_size = (
+          filename,sample_freq,format,gain,peak,chunk_size)
+    self.n_samples = 0 # number of samples received so far
+    self.max_abs = 0.0
+    self.illegal_at = -1 # index of the first illegal sample, if any
+    self.illegal_value = 0.0
+    self.f = open(filename,'wb')
+    self.f.write(header(format,sample_freq,0)) # sizes get filled in by close()
+    self.temp = None
+    if gain is None:
+      self.temp = tempfile.TemporaryFile()
+
+  def write(self,y):
+    # y can be any one-dimensional array-like thing; it isn't modified
+    y = sanitize(numpy.asarray(y,dtype=numpy.float32),self)
+    self.n_samples += len(y)
+    if len(y)>0:
+      self.max_abs = max(self.max_abs,float(numpy.max(numpy.abs(y))))
+    if self.temp is None:
+      self.f.write(convert(y,self.gain,self.format))
+    else:
+      y.tofile(self.temp)
+
+  def close(self):
+    if self.illegal_at>=0:
+      print("warning, illegal values in output data, first is at i=",self.illegal_at,", value=",self.illegal_value)
+    if self.temp is not None:
+      if self.max_abs>0.0:
+        self.gain = self.peak/self.max_abs
+      else:
+        self.gain = 1.0
+      self.temp.flush()
+      if self.n_samples>0:
+        y = numpy.memmap(self.temp,dtype=numpy.float32,mode='r',shape=(self.n_samples,))
+        for j in range(0,self.n_samples,self.chunk_size):
+          self.f.write(convert(y[j:j+self.chunk_size],self.gain,self.format))
+        del y
+      self.temp.close()
+      self.temp = None
+    if self.n_samples*FORMATS[self.format][0]%2==1:
+      self.f.write(b'\0') # RIFF chunks have to be padded to an even length
+    self.f.seek(0)
+    self.f.write(header(self.format,self.sample_freq,self.n_samples))
+    self.f.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self,exc_type,exc_value,traceback):
+    self.close()
+
+def write_file(filename,y,sample_freq,format='int16',gain=None,peak=0.3):
+  # Write a whole array at once; see WavWriter for the meaning of the arguments.
+  w = WavWriter(filename,sample_freq,format,gain,peak)
+  w.write(y)
+  w.close()
+
+def sanitize(y,w):
+  """
+  Returns a copy of y with NaNs and out-of-range values replaced by zero, and records the first one in w, which is
+  a WavWriter. Returns y itself if there is nothing to fix.
+  """
+  bad = numpy.logical_not(numpy.abs(y)<=MAX_LEGAL) # true for NaN as well
+  if not numpy.any(bad):
+    return y
+  i = int(numpy.argmax(bad))
+  if w.illegal_at<0:
+    w.illegal_at = w.n_samples+i
+    w.illegal_value = float(y[i])
+  return numpy.where(bad,numpy.float32(0.0),y)
+
+def convert(y,gain,format):
+  # Returns the bytes to write to the file for the samples y, which are in units where 1.0 is full scale before the gain.
+  size,code,full_scale = FORMATS[format]
+  x = numpy.asarray(y,dtype=numpy.float64)*gain
+  if format=='float32':
+    return x.astype('<f4').tobytes()
+  x = numpy.clip(numpy.rint(x*full_scale),-full_scale,full_scale)
+  if format=='int16':
+    return x.astype('<i2').tobytes()
+  # 24-bit: the low three bytes of each little-endian 32-bit integer
+  return x.astype('<i4').view(numpy.uint8).reshape(-1,4)[:,0:3].tobytes()
+
+def header(format,sample_freq,n_samples):
+  # RIFF header for mono data; the wave module in the standard library can't do floating point, so we do it ourselves.
+  size,code,full_scale = FORMATS[format]
+  sample_freq = int(sample_freq)
+  data_size = n_samples*size
+  fmt = struct.pack('<HHIIHH',code,1,sample_freq,sample_freq*size,size,8*size)
+  return (b'RIFF'+struct.pack('<I',4+(8+len(fmt))+(8+data_size+data_size%2))+b'WAVE'
+          +b'fmt '+struct.pack('<I',len(fmt))+fmt
+          +b'data'+struct.pack('<I',data_size))